@@ -13,11 +13,15 @@ from settings import COMBO_SERVER_ADDRESS
 class ComboCommands(object):
     def __init__(self):
         self._main_parser = argparse.ArgumentParser(description='Combo dependencies manager')
+        self._server_session = None
 
         self.add_subparsers()
         self._args = self._main_parser.parse_args()
 
-        self._args.command()
+        try:
+            self._args.command()
+        finally:
+            self.close_server_session()
         print('Done')
 
     def add_subparsers(self):
@@ -29,6 +33,27 @@ class ComboCommands(object):
                                    nargs='?', default=None)
             subparser.add_argument('--path', '-p', help='The path of the repository', nargs='?', default=None)
             subparser.add_argument('--force', '-f', action="store_true", help='Ignore corrupted dependencies')
+            subparser.add_argument('--jobs', help='Amount of concurrent dependency fetches, defaults to CPUs amount',
+                                   type=int, default=None)
+            subparser.add_argument('--pool-type', help='Concurrent fetching pool type',
+                                   choices=sorted(ComboTree.POOL_TYPES.keys()), default='thread')
+            subparser.add_argument('--hash-algorithm', help='Hash algorithm of newly cached dependencies',
+                                   choices=DirectoryHasher.ALGORITHMS, default=None)
+            subparser.add_argument('--extern-mode', help='How dependencies are placed in the output directory, '
+                                                         'linked modes share the files with the cache. Symbolic '
+                                                         'links are left dangling when the cache evicts their '
+                                                         'targets, is-dirty reports them as dirty and resolve '
+                                                         'links them again',
+                                   choices=sorted(DependenciesManager.EXTERN_MODES.keys()), default=None)
+            subparser.add_argument('--cache-size', help='Size limit of the dependencies cache in MB',
+                                   type=int, default=None)
+            subparser.add_argument('--eviction-policy', help='The order of evicting dependencies from the cache',
+                                   choices=sorted(EVICTION_POLICIES.keys()), default=None)
+            subparser.add_argument('--metadata-store', help='Where the metadata of the cached dependencies is kept',
+                                   choices=sorted(METADATA_STORES.keys()), default=None)
+            subparser.add_argument('--no-git-mirrors', help='Clone git dependencies straight from their remotes, '
+                                                            'fetching only the commit of each version',
+                                   dest='git_mirrors', action='store_false')
 
         # Resolve
         resolve_parser = subparsers.add_parser('resolve')
@@ -67,7 +92,19 @@ class ComboCommands(object):
 
             print('Sources json was not specified. Combo server will be contacted for sources')
 
-        return RemoteSourceMaintainer(COMBO_SERVER_ADDRESS)
+        # The server connections are pooled for the concurrent dependency fetches
+        self._server_session = ServerSession(pool_size=getattr(self._args, 'jobs', None))
+        return RemoteSourceMaintainer(COMBO_SERVER_ADDRESS, self._server_session)
+
+    def close_server_session(self):
+        if self._server_session is None:
+            return
+
+        requests_amount, retries_amount, total_latency = self._server_session.stats()
+        print('Combo server requests: {}, retries: {}, total latency: {:.2f} seconds'.format(
+            requests_amount, retries_amount, total_latency))
+        self._server_session.close()
+        self._server_session = None
 
     def get_working_dir(self):
         work_dir = Directory(self._args.path or os.path.curdir)
@@ -80,7 +117,11 @@ class ComboCommands(object):
     def get_dependencies_manager(self):
         work_dir = self.get_working_dir()
         sources_locator = self.get_sources_locator()
-        return DependenciesManager(work_dir, sources_locator)
+        cache_size = self._args.cache_size * 1024**2 if self._args.cache_size is not None else None
+        return DependenciesManager(work_dir, sources_locator, self._args.jobs, self._args.pool_type,
+                                   self._args.hash_algorithm, self._args.extern_mode,
+                                   cache_size, self._args.eviction_policy, self._args.metadata_store,
+                                   self._args.git_mirrors)
 
     def resolve(self):
         manager = self.get_dependencies_manager()
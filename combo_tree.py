@@ -2,6 +2,8 @@ from __future__ import print_function
 from combo_core import *
 from combo_core.manifest import *
 from combo_core.version import *
+from multiprocessing.pool import Pool, ThreadPool
+from contextlib import contextmanager
 
 
 class CircularDependency(ComboException):
@@ -12,195 +14,362 @@ class NotAllowedDependency(ComboException):
     pass
 
 
-class UndecidedTable(dict):
-    def __init__(self, dependencies=list()):
-        super(dict, self).__init__()
+class DependencyNode(object):
+    """
+    A node of the dependencies graph. Every dependency has a single node, shared by all of its dependents
+    """
+    __slots__ = ('value', 'sons', 'names')
 
-        for dep in dependencies:
-            eliminators = [eliminator for eliminator in dependencies if self.is_eliminator(dep, eliminator)]
-            if any(eliminators):
-                self[dep] = {
-                    'eliminators': eliminators,
-                    'criticals': self.find_critical(dep, eliminators),
-                    'alive': True,
-                    'incompatible_eliminated': set()
-                }
+    def __init__(self, value):
+        self.value = value
+        self.sons = list()
 
-    def __str__(self):
-        result = ''
-        for undecided, details in self.items():
-            result += 'Dependency {}: alive={}, incompatible_eliminated={}, eliminators={}, criticals={}'.format(
-                str(undecided), details['alive'], [str(x) for x in details['incompatible_eliminated']],
-                [str(x) for x in details['eliminators']], [str(x) for x in details['criticals']]) + '\n'
-        return result
+        # The project names of the node and all the nodes below it, used to identify circular dependencies
+        self.names = {value.name}
+
+
+class UndecidableVersions(ComboException):
+    pass
+
+
+class VersionSelector(object):
+    """
+    Disconnects every version of a project from the dependencies graph, except for a single one.
+
+    The selection goes in rounds:
+        1. decide - A project is decided once its newest connected version is reachable from the root
+           through the newest versions of their projects alone.
+        2. eliminate - The older versions of the newly decided projects are disconnected.
+           Dependencies which are required only by disconnected dependencies are disconnected as well,
+           which may leave an older version of another project as its newest connected one.
+        3. check - An older version which is still required by a connected dependency, but was eliminated by
+           an incompatible version, means the versions conflict.
+
+    Nodes are only disconnected over the rounds, so every node is decided and disconnected once,
+    and every edge is followed a constant amount of times.
+    """
+    def __init__(self, head):
+        self._head = head
+
+        self._parents = dict()
+        self._references = dict()
+        self._connected = {head}
+        self._decided = {head}
+
+        # The nodes of each project, newest first, and the index of the newest connected one
+        self._versions = dict()
+        self._newest_index = dict()
+        self._connected_versions = dict()
+        self._undecided_names = set()
+
+    def _connect_graph(self):
+        nodes = [self._head]
+        while nodes:
+            node = nodes.pop()
+            for son in node.sons:
+                self._parents.setdefault(son, list()).append(node)
+                self._references[son] = self._references.get(son, 0) + 1
+                if son not in self._connected:
+                    self._connected.add(son)
+                    nodes.append(son)
+
+        for node in self._connected - {self._head}:
+            self._versions.setdefault(node.value.name, list()).append(node)
+
+        for name, versions in self._versions.items():
+            versions.sort(key=lambda version_node: version_node.value.version, reverse=True)
+            self._newest_index[name] = 0
+            self._connected_versions[name] = len(versions)
+            if len(versions) > 1:
+                self._undecided_names.add(name)
+
+    def _newest(self, name):
+        # Nodes are never connected again, so the index only moves forward
+        versions = self._versions[name]
+        index = self._newest_index[name]
+        while index < len(versions) and versions[index] not in self._connected:
+            index += 1
+
+        self._newest_index[name] = index
+        return versions[index] if index < len(versions) else None
+
+    def _decide(self, nodes):
+        """
+        Decide the newest versions reachable from the given nodes
+        :param nodes: Nodes which were decided, or became the newest versions of their projects
+        :return: The names of the newly decided projects
+        """
+        decided_names = list()
+        nodes = [node for node in nodes
+                 if node in self._decided or any(parent in self._decided for parent in self._parents[node])]
+
+        for node in nodes:
+            if node not in self._decided:
+                self._decided.add(node)
+                decided_names.append(node.value.name)
+
+        while nodes:
+            node = nodes.pop()
+            for son in node.sons:
+                if son not in self._decided and son in self._connected and self._newest(son.value.name) is son:
+                    self._decided.add(son)
+                    decided_names.append(son.value.name)
+                    nodes.append(son)
+
+        return decided_names
+
+    def _disconnect(self, nodes):
+        """
+        Disconnect the given nodes, and the nodes which are required only by disconnected nodes
+        :return: The nodes which became the newest versions of their projects
+        """
+        changed_names = set()
+
+        for node in nodes:
+            self._connected.discard(node)
+
+        while nodes:
+            node = nodes.pop()
+            name = node.value.name
+
+            self._connected_versions[name] -= 1
+            if self._connected_versions[name] <= 1:
+                self._undecided_names.discard(name)
+            changed_names.add(name)
+
+            for son in node.sons:
+                self._references[son] -= 1
+                if self._references[son] == 0 and son in self._connected:
+                    self._connected.discard(son)
+                    nodes.append(son)
+
+        newest_nodes = [self._newest(name) for name in changed_names]
+        return [node for node in newest_nodes if node is not None and node not in self._decided]
+
+    def _check_eliminated(self, eliminated):
+        """
+        Raise if an eliminated version is still required by a connected dependency, and its newest version is
+        incompatible. The error is raised for the first of them found from the root, depth first
+        """
+        def incompatible(node):
+            newest = self._newest(node.value.name)
+            return not VersionNumber.compatible(newest.value.version, node.value.version)
+
+        conflicts = [node for node in eliminated
+                     if any(parent in self._connected for parent in self._parents[node]) and incompatible(node)]
+        if not conflicts:
+            return
+
+        conflicts = set(conflicts)
+        visited = set()
+
+        def find_conflict(head):
+            for son in head.sons:
+                if son in self._connected:
+                    if son not in visited:
+                        visited.add(son)
+                        find_conflict(son)
+                elif son in conflicts:
+                    raise IncompatibleVersions('Dependency {} could not be replaced by {}'.format(
+                        son.value, self._newest(son.value.name).value))
+
+        find_conflict(self._head)
+
+    def select(self):
+        self._connect_graph()
+        newly_decided = [self._head]
 
-    def get(self, dep):
-        if dep not in self.keys():
-            raise KeyError('Dependency {} is not undecided'.format(dep))
-        return self[dep]
+        while self._undecided_names:
+            decided_names = self._decide(newly_decided)
 
-    def is_alive(self, dep):
-        if dep not in self.keys():
-            return True
-        return self[dep]['alive']
+            eliminated = [node for name in decided_names for node in self._versions[name]
+                          if node in self._connected and node is not self._newest(name)]
+            if not eliminated:
+                raise UndecidableVersions('Could not decide between the versions of {}'.format(
+                    ', '.join(sorted(self._undecided_names))))
 
-    @staticmethod
-    def is_eliminator(undecided, eliminator):
-        return eliminator.name == undecided.name and eliminator.version > undecided.version
+            newly_decided = self._disconnect(list(eliminated))
+            self._check_eliminated(eliminated)
 
-    @staticmethod
-    def find_critical(undecided, all_eliminators):
-        return list(filter(lambda elm: not VersionNumber.compatible(elm.version, undecided.version), all_eliminators))
+        # Only the connected nodes are left in the graph
+        for node in self._connected:
+            node.sons = [son for son in node.sons if son in self._connected]
 
 
 class ComboTree:
-    def __init__(self, dependency_importer):
-        self.original_nodes = dict()
+    POOL_TYPES = {
+        'thread': ThreadPool,
+        'process': Pool
+    }
+
+    def __init__(self, dependency_importer, jobs=None, pool_type='thread'):
+        """
+        :param dependency_importer: The importer used to clone the dependencies
+        :param jobs: Amount of concurrent fetches while building, None for the amount of CPUs, 1 for serial fetching
+        :param pool_type: The type of the fetching pool, see POOL_TYPES
+        """
+        if pool_type not in self.POOL_TYPES:
+            raise KeyError('Unsupported pool type "{}"'.format(pool_type))
+
+        self.nodes = dict()
         self.manifests = dict()
 
         self._importer = dependency_importer
-        self._undecideds = UndecidedTable()
+        self._jobs = jobs
+        self._pool_type = pool_type
 
         self._dependencies = list()
-        self._head = dict()
+        self._head = None
         self._done = False
 
+    @property
+    def original_nodes(self):
+        """ The node of every dependency in the graph, by the name used before the nodes were shared """
+        return self.nodes
+
     def ready(self):
         return self._done
 
+    @contextmanager
+    def _fetching_pool(self):
+        pool = self.POOL_TYPES[self._pool_type](self._jobs) if self._jobs != 1 else None
+        try:
+            yield pool
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _fetch_manifests(self, base_manifest):
+        """
+        Fetch the manifest of every dependency reachable from the given manifest, breadth first.
+        All the new dependencies found in the same wave are fetched concurrently.
+        Dependencies are not cloned for their manifest, unless their source can not provide it alone.
+        :return: A dictionary of each dependency and its manifest
+        """
+        fetched = dict()
+        wave = [ComboDep(dep['name'], dep['version']) for dep in base_manifest.sons()]
+        queued = set(wave)
+
+        with self._fetching_pool() as pool:
+            while wave:
+                manifest_dirs = self._importer.fetch_files(wave, Manifest.manifest_file_name, pool)
+
+                next_wave = list()
+                for combo_dependency, manifest_dir in zip(wave, manifest_dirs):
+                    fetched[combo_dependency] = Manifest(manifest_dir, combo_dependency)
+
+                    for dep in fetched[combo_dependency].sons():
+                        son_dependency = ComboDep(dep['name'], dep['version'])
+                        if son_dependency not in queued:
+                            queued.add(son_dependency)
+                            next_wave.append(son_dependency)
+
+                wave = next_wave
+
+        return fetched
+
     def build(self, base_manifest):
-        """ Build the tree from the given manifest data recursively """
-        def build_tree(head_value, sons=list(), path=list()):
+        """ Build the graph from the given manifest data recursively """
+        fetched_manifests = self._fetch_manifests(base_manifest)
+
+        def check_circular(head_value, path, path_names):
+            if head_value.name in path_names:
+                higher_dep = xfilter(lambda dep: dep.name == head_value.name, path)
+                raise CircularDependency('Dependency {} eventually requires {}'.format(higher_dep, head_value),
+                                         ' -> '.join(map(str, path + [head_value])))
+
+        def check_shared_node(node, path, path_names):
             """
-            In this step, every dependency of the current manifest will be cloned, followed by his own dependencies.
-            This function will continue recursively.
-            Additionally, while cloning a dependencies tree is going to be built.
+            Check a node which was already built from a different path, and the nodes below it, against this path
+            """
+            check_circular(node.value, path, path_names)
+
+            for son in node.sons:
+                check_shared_node(son, path + [node.value], path_names | {node.value.name})
 
-            :param head_value: The content of the current node of the tree
+        def build_node(head_value, sons=list(), path=list(), path_names=frozenset()):
+            """
+            In this step, every dependency of the current manifest is connected to the graph,
+            followed by his own dependencies. This function will continue recursively.
+            The manifests of all the dependencies were already fetched at this point.
+            A dependency required by multiple dependents is built once, and its node is shared by them.
+
+            :param head_value: The content of the current node of the graph
             :param sons:       A list of the sons (dependencies) that should be added next
             :param path:       The previous dependencies that has led here, used to identify circular dependencies
+            :param path_names: The project names of the path, for a quick lookup
             """
+            check_circular(head_value, path, path_names)
 
-            tree_head = {'value': head_value}
+            head = DependencyNode(head_value)
             next_path = path + [head_value]
-
-            if head_value.name in [dep.name for dep in path]:
-                higher_dep = xfilter(lambda dep: dep.name == head_value.name, path)
-                raise CircularDependency('Dependency {} eventually requires {}'.format(higher_dep, head_value),
-                                         ' -> '.join(map(str, next_path)))
+            next_path_names = path_names | {head_value.name}
 
             for dep in sons:
-                add_dep_node_flag = False
                 combo_dependency = ComboDep(dep['name'], dep['version'])
 
-                dependency_values = [dep_node['value'] for dep_node in self.original_nodes.values()]
-                if combo_dependency not in dependency_values:
-                    add_dep_node_flag = True
-                    cached_clone = self._importer.clone(combo_dependency)
-                else:
-                    cached_clone = self._importer.get_cached_path(combo_dependency)
-
-                # Clone the recursive dependencies of the current dependency
-                dependency_manifest = Manifest(cached_clone, combo_dependency)
+                if combo_dependency in self.nodes:
+                    son = self.nodes[combo_dependency]
 
-                if not dependency_manifest.valid_as_lib():
-                    raise NotAllowedDependency('Dependency {} cannot be used as a library'.format(combo_dependency))
+                    # Only a path leading to one of the projects below the shared node may be circular
+                    if son.names & next_path_names:
+                        check_shared_node(son, next_path, next_path_names)
+                else:
+                    # Connect the recursive dependencies of the current dependency
+                    dependency_manifest = fetched_manifests[combo_dependency]
 
-                self._add_manifest(combo_dependency, dependency_manifest)
-                next_sons = dependency_manifest.sons()
+                    if not dependency_manifest.valid_as_lib():
+                        raise NotAllowedDependency('Dependency {} cannot be used as a library'.format(combo_dependency))
 
-                tree_head[combo_dependency] = build_tree(combo_dependency, next_sons, next_path)
+                    self._add_manifest(combo_dependency, dependency_manifest)
+                    son = build_node(combo_dependency, dependency_manifest.sons(), next_path, next_path_names)
+                    self.nodes[combo_dependency] = son
 
-                if add_dep_node_flag:
-                    self._add_node(tree_head[combo_dependency])
+                head.sons.append(son)
+                head.names |= son.names
 
-            return tree_head
+            return head
 
-        # clone everything - recursive clone, keeping both older and newer versions. Create a tree in the process.
-        self._head = build_tree(ComboRoot(), base_manifest.sons())
+        # Fetch every manifest - keeping both older and newer versions. Create a graph from the manifests afterwards.
+        self._head = build_node(ComboRoot(), base_manifest.sons())
         self._dependencies = self._extract_values()
 
     def values(self):
         return self._dependencies
 
-    def disconnect_outdated_versions(self):
-        """ Remove all irrelevant nodes from the tree using the following algorithm: """
-
-        while not self._is_slashed():
-            '''
-            1. create_undecided_table:
-                Iterate all dependencies. Mark undecided if there is a newer version somewhere.
-                For each undecided dependency, mark it's eliminators (newer versions of the same project).
-                Out of the eliminators, save the critical eliminators of it,
-                which are the eliminators with an incompatible version.
-                Additionally, save an 'alive' flag which always starts as True,
-                and 'incompatible_eliminated' which starts as an empty set.
-                
-                undecided_table_example = {
-                    "A-0.1": {
-                        "eliminators": ["A-0.2", "A-1.0"], "criticals": ["A-1.0"],
-                        "alive": True, "incompatible_eliminated": set()
-                    },
-                    "A-0.2": {
-                        "eliminators": ["A-1.0"], "criticals": ["A-1.0"],
-                        "alive": True, "incompatible_eliminated": set()
-                    },
-                    "B-0.1": {
-                        "eliminators": ["B-0.2"], "criticals": [],
-                        "alive": True, "incompatible_eliminated": set()
-                    }
-                }             
-            '''
-            self._undecideds = UndecidedTable(self._dependencies)
-
-            '''
-            2. mark_deads - Go through the tree:
-                if is_undecided:
-                    pass  # Don't go through the node's sons
-                else:
-                    for each undecided:
-                        if node_is_eliminator:
-                            mark_as_dead
-                            if node_is_critical_eliminator:
-                                save_as_incompatible_eliminated
-                    step_in()  # Recursive                
-            '''
-            self._mark_deads()
-
-            ''' 3. step_in_alive_undecideds - Perform step 3 on every alive "undecided" from the undecided table '''
-            self._step_in_undecided()
-
-            '''
-            4. remove_deads_from_tree:
-                Go through the tree, if a node is marked as "dead" on the undecided table,
-                remove the node from the tree (this will remove his "sons" as well).
-                
-                If a "directly" removed node is "incompatible_eliminated",
-                this means there is an error since the older version was connected to the tree
-                and it is removed because of an incompatible version. 
-                
-                If a "incompatible_eliminated" node was removed "indirectly",
-                this is fine because the "incompatible_eliminated" node wasn't required anyway.
-            '''
-            self._slash_deads()
+    def restore(self, dependencies, manifests):
+        """
+        Use dependencies which were already resolved by a previous run, without building the graph
+        :param manifests: The manifest of each dependency read while resolving them
+        """
+        self._dependencies = set(dependencies)
+        self.manifests = dict(manifests)
+        self._done = True
+
+    def clone_values(self):
+        """ Clone the dependencies of the graph, which were not necessarily cloned while building it """
+        with self._fetching_pool() as pool:
+            self._importer.clone_all(list(self._dependencies), pool)
 
+    def disconnect_outdated_versions(self):
+        """ Remove all irrelevant nodes from the graph, leaving a single version of each project """
+        VersionSelector(self._head).select()
+        self._dependencies = self._extract_values()
         self._done = True
 
-    def _extract_values(self, head=None):
-        head = head or self._head
+    def _extract_values(self):
         values_set = set()
 
-        for son in self._get_sons(head):
-            values_set.add(son['value'])
-            values_set |= self._extract_values(son)
+        def extract(head):
+            for son in head.sons:
+                if son.value not in values_set:
+                    values_set.add(son.value)
+                    extract(son)
 
+        extract(self._head)
         return values_set
 
-    def _is_slashed(self):
-        instances = {dep.name: len(list(filter(lambda x: x.name == dep.name, self._dependencies)))
-                     for dep in self._dependencies}
-        return all(count == 1 for count in instances.values())
-
     def __str__(self):
         def recursive_str(head=None, indentation=0):
             def new_line(indent):
@@ -208,73 +377,15 @@ class ComboTree:
 
             head = head or self._head
 
+            # Shared nodes are written under each of their dependents
             separator = ',' + new_line(indentation + 1)
-            sons = separator.join(recursive_str(son, indentation + 1) for son in self._get_sons(head))
+            sons = separator.join(recursive_str(son, indentation + 1) for son in head.sons)
             wrapped = new_line(indentation) + '{' + new_line(indentation + 1) + sons + new_line(indentation) + '}'
 
-            return str(head['value']) + ': ' + (wrapped if sons else '{}')
+            return str(head.value) + ': ' + (wrapped if sons else '{}')
 
         return recursive_str() + '\n'
 
-    def _add_node(self, dependency_node):
-        if dependency_node not in self.original_nodes.values():
-            self.original_nodes[dependency_node['value']] = dependency_node
-
-    @staticmethod
-    def _get_sons(head):
-        # Only the dict values are relevant
-        return [head[key] for key in head.keys() if key != 'value']
-
-    def _mark_deads(self, head=None):
-        head = head or self._head
-
-        if head['value'] in self._undecideds:
-            return
-
-        # If a node is eliminated, mark it as dead
-        for undecided in self._undecideds.values():
-            if head['value'] in undecided['eliminators']:
-                undecided['alive'] = False
-                # If the eliminator is critical, this means that if the undecided is relevant there is a problem
-                if head['value'] in undecided['criticals']:
-                    undecided['incompatible_eliminated'].add(head['value'])
-
-        for son in self._get_sons(head):
-            # Continue recursively
-            self._mark_deads(son)
-
-    def _step_in_undecided(self):
-        # Iterate all alive undecided
-        for key, undecided in self._undecideds.items():
-            if undecided['alive']:
-                # Perform the "mark deads" step of each node of the current dependency
-                for node in self.original_nodes.values():
-                    if node['value'] == key:
-                        self._mark_deads(node)
-
-    def _slash_deads(self):
-        def recursive_slash(head=None):
-            head = head or self._head
-            pop_list = list()
-
-            for son in self._get_sons(head):
-                if self._undecideds.is_alive(son['value']):
-                    recursive_slash(son)
-                else:
-                    # If we explicitly need to remove an incompatible node, this means there is a problem
-                    if son['value'] in self._undecideds:
-                        incompatible_eliminator = self._undecideds.get(son['value'])['incompatible_eliminated']
-                        if incompatible_eliminator:
-                            raise IncompatibleVersions('Dependency {} could not be replaced by {}'.format(
-                                son['value'], ', '.join(map(str, incompatible_eliminator))))
-                    pop_list.append(son['value'])
-
-            for son_to_pop in pop_list:
-                head.pop(son_to_pop)
-
-        recursive_slash()
-        self._dependencies = self._extract_values()
-
     def _add_manifest(self, dep, manifest):
         if dep not in self.manifests.keys():
             self.manifests[dep] = manifest
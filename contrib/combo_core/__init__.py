@@ -1,4 +1,9 @@
 from .utils import *
+from .compat import appdata_dir_path
+import os
+
+# Directory hashes are indexed persistently in the app data directory
+HashIndex.index_dir = os.path.join(appdata_dir_path, 'hash_index')
 
 
 class ComboException(BaseException):
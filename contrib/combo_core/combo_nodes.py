@@ -51,7 +51,12 @@ class ComboDep(ComboNode):
         return hash(self.as_tuple())
 
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        if not isinstance(other, ComboDep):
+            return False
+        return self.name == other.name and self.version == other.version
+
+    def __ne__(self, other):
+        return not self == other
 
     def __lt__(self, other):
         if not isinstance(other, type(self)):
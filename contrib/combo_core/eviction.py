@@ -0,0 +1,47 @@
+"""
+Policies which decide the order of evicting cached dependencies, by the metadata stored for each of them
+"""
+
+import time
+
+
+class EvictionPolicy(object):
+    def _priority(self, dep_data, now):
+        """
+        :return: A sortable value, dependencies with lower values are evicted first
+        """
+        raise NotImplementedError()
+
+    def order(self, cached_projects):
+        """
+        :param cached_projects: The stored data of the cached dependencies, by their string representation
+        :return: The cached dependencies strings, in the order they should be evicted
+        """
+        now = time.time()
+        ordered = sorted(cached_projects.items(), key=lambda item: self._priority(item[1], now))
+        return [dep_str for dep_str, _ in ordered]
+
+
+class LeastRecentlyUsed(EvictionPolicy):
+    def _priority(self, dep_data, now):
+        return dep_data.get('last_access', 0)
+
+
+class LeastFrequentlyUsed(EvictionPolicy):
+    def _priority(self, dep_data, now):
+        # Dependencies used the same amount of times are evicted by their last access
+        return dep_data.get('access_count', 0), dep_data.get('last_access', 0)
+
+
+class SizeAware(EvictionPolicy):
+    def _priority(self, dep_data, now):
+        # Large dependencies which were not used for a long time are evicted first
+        idle_time = now - dep_data.get('last_access', 0)
+        return -(dep_data.get('size', 0) * idle_time)
+
+
+EVICTION_POLICIES = {
+    'lru': LeastRecentlyUsed,
+    'lfu': LeastFrequentlyUsed,
+    'size': SizeAware
+}
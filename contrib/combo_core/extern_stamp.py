@@ -0,0 +1,101 @@
+"""
+A record of the dependencies placed in an output directory, kept in the output directory itself
+"""
+
+from .combo_nodes import *
+import os
+import json
+
+
+class ExternStamp(object):
+    """
+    Every externed file is recorded with its size, mtime, inode and digest,
+    so the modified files of a dependency are found by their stat, and only those files are hashed
+    """
+    FILE_NAME = '.combo_stamp.json'
+
+    def __init__(self, output_dir):
+        self.file_path = output_dir.join(self.FILE_NAME).path
+
+        # The records of the dependencies by their directory names, and the modified files found during this run
+        self._records = dict()
+        self._modified = dict()
+        self._written_at = 0
+        self._changed = False
+
+        try:
+            with open(self.file_path, 'r') as f:
+                self._records = json.load(f)['dependencies']
+            self._written_at = stat_record(self.file_path)[1]
+        except (EnvironmentError, ValueError, KeyError):
+            # A missing or broken stamp is the same as an empty one
+            pass
+
+    def dependency(self, contrib_dir):
+        """
+        :return: The combo dependency recorded in the given directory, None if it was not recorded
+        """
+        record = self._records.get(contrib_dir.name())
+        return ComboDep.destring(record['dep']) if record is not None else None
+
+    def directory_names(self):
+        return list(self._records.keys())
+
+    def record(self, dep, contrib_dir, algorithm):
+        hasher = DirectoryHasher(algorithm)
+        files = dict()
+        for rel_path, file_path in contrib_dir.files():
+            files[rel_path.replace(os.sep, '/')] = stat_record(file_path) + [hasher.hash_file(file_path)]
+
+        self._records[contrib_dir.name()] = {'dep': str(dep), 'algorithm': algorithm, 'files': files}
+        self._modified[contrib_dir.name()] = list()
+        self._changed = True
+
+    def forget(self, contrib_dir):
+        if self._records.pop(contrib_dir.name(), None) is not None:
+            self._changed = True
+        self._modified.pop(contrib_dir.name(), None)
+
+    def _unchanged(self, recorded, current_stat):
+        # A file modified at the same time the stamp was written might have changed without affecting its mtime
+        return recorded[:3] == current_stat and current_stat[1] < self._written_at
+
+    def modified_files(self, contrib_dir):
+        """
+        :return: The relative paths of the files added, removed or modified since the directory was recorded,
+                 None if it was not recorded
+        """
+        name = contrib_dir.name()
+        if name not in self._records:
+            return None
+        if name in self._modified:
+            return self._modified[name]
+
+        record = self._records[name]
+        recorded_files = record['files']
+        hasher = DirectoryHasher(record['algorithm'])
+
+        current_files = {rel_path.replace(os.sep, '/'): file_path for rel_path, file_path in contrib_dir.files()}
+        modified = set(recorded_files).symmetric_difference(current_files)
+
+        for rel_path in set(recorded_files).intersection(current_files):
+            file_path = current_files[rel_path]
+            if self._unchanged(recorded_files[rel_path], stat_record(file_path)):
+                continue
+            if hasher.hash_file(file_path) != recorded_files[rel_path][3]:
+                modified.add(rel_path)
+
+        self._modified[name] = sorted(modified)
+        return self._modified[name]
+
+    def write(self):
+        if not self._changed:
+            return
+
+        # Written to a temporary file first, so a partially written stamp is never read
+        temp_path = self.file_path + '.tmp{}'.format(os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'dependencies': self._records}, f, separators=(',', ':'), sort_keys=True)
+        replace_file(temp_path, self.file_path)
+        self._written_at = stat_record(self.file_path)[1]
+        self._changed = False
@@ -1,7 +1,11 @@
 from combo_core import *
+from .compat import appdata_dir_path
 import git
 import gc
 import os
+import hashlib
+import tempfile
+import threading
 
 
 class ReferenceNotFound(ComboException):
@@ -31,13 +35,31 @@ class GitRepo:
         self._repo = git.Repo(self._git_dir.path)
         self._loaded = True
 
-    def clone(self, remote_url, ref=None):
+    def clone(self, remote_url, ref=None, shallow=True):
+        """
+        :param ref: The reference to checkout after cloning, the default branch if not specified
+        :param shallow: Fetch only the commit of the given reference, without its history
+        """
         if not self.empty():
             raise EnvironmentError()
 
         if not self.local_path.exists():
             os.makedirs(self.local_path.path)
 
+        if ref and shallow:
+            try:
+                self._shallow_clone(remote_url, ref)
+                return
+            except git.GitCommandError as e:
+                # Some remotes refuse to fetch commits which are not advertised, clone the full history instead
+                print('Could not fetch {} of {} directly, cloning the full history: {}'.format(ref, remote_url, e))
+                self._repo = None
+                self._loaded = False
+
+                # The failed checkout might have left files besides the git directory
+                self.local_path.delete()
+                os.makedirs(self.local_path.path)
+
         # TODO: Add timeout. Fix 'local_projects.json' file in case of timeout before exiting
         self._repo = git.Repo.clone_from(remote_url, self.local_path.path)
         self._loaded = True
@@ -45,6 +67,14 @@ class GitRepo:
         if ref:
             self.checkout(ref)
 
+    def _shallow_clone(self, remote_url, ref):
+        self._repo = git.Repo.init(self.local_path.path)
+        self._loaded = True
+
+        self._repo.create_remote('origin', remote_url)
+        self._repo.git.fetch('origin', ref, depth=1)
+        self._repo.git.checkout('FETCH_HEAD', quiet=True, detach=True)
+
     def remote_url(self, remote_name):
         assert self._loaded, 'Trying to get remote URL of a repository which was not loaded'
         remote = xfilter(lambda r: r.name == remote_name, self._repo.remotes)
@@ -82,3 +112,100 @@ class GitRepo:
     def delete(self):
         self.close()
         self.local_path.delete()
+
+
+class GitMirror:
+    """
+    A bare mirror of a remote repository, shared by the clones of all of its versions.
+    The mirror is fetched only when a requested commit is missing from it.
+    """
+    mirrors_dir = os.path.join(appdata_dir_path, 'git_mirrors')
+
+    # Concurrent clones of the same remote must not fetch into the same mirror together
+    _locks = dict()
+    _locks_guard = threading.Lock()
+
+    def __init__(self, remote_url):
+        self.remote_url = remote_url
+        mirror_name = hashlib.md5(remote_url.encode()).hexdigest() + '.git'
+        self.local_path = Directory(os.path.join(self.mirrors_dir, mirror_name))
+
+        with self._locks_guard:
+            self._lock = self._locks.setdefault(self.local_path.path, threading.Lock())
+
+        self._repo = None
+
+    def _load(self):
+        if self._repo is not None:
+            return
+
+        if not self.local_path.exists():
+            # Mirror into a temporary directory first, so an interrupted mirroring is never used
+            temp_path = self.local_path.path + '.tmp{}'.format(os.getpid())
+            Directory(temp_path).delete()
+
+            print('Mirroring {} into {}'.format(self.remote_url, self.local_path))
+            git.Repo.clone_from(self.remote_url, temp_path, mirror=True)
+            os.rename(temp_path, self.local_path.path)
+
+        self._repo = git.Repo(self.local_path.path)
+
+    def has_commit(self, commit_hash):
+        try:
+            self._repo.git.cat_file('-e', commit_hash + '^{commit}')
+            return True
+        except git.GitCommandError:
+            return False
+
+    def _fetch(self, commit_hash):
+        print('Fetching {} into {}'.format(self.remote_url, self.local_path))
+        self._repo.git.fetch('origin', '--prune')
+
+        if not self.has_commit(commit_hash):
+            # The commit might not be referenced anymore, some remotes still allow fetching it directly
+            try:
+                self._repo.git.fetch('origin', commit_hash)
+            except git.GitCommandError as e:
+                raise ReferenceNotFound(self.remote_url, commit_hash, e)
+
+    def ensure_commit(self, commit_hash):
+        # Threads of this process wait on the thread lock, other processes on the lock file
+        with self._lock, FileLock(self.local_path.path + '.lock'):
+            self._load()
+            if not self.has_commit(commit_hash):
+                self._fetch(commit_hash)
+
+    def read_file(self, commit_hash, file_path):
+        """
+        :return: The content of a single file of the given commit as bytes, None if the commit doesn't contain it
+        """
+        self.ensure_commit(commit_hash)
+
+        try:
+            # Read as is, without decoding the content or stripping its last newline
+            return self._repo.git.show('{}:{}'.format(commit_hash, file_path), stdout_as_string=False,
+                                       strip_newline_in_stdout=False)
+        except git.GitCommandError:
+            return None
+
+    def export(self, commit_hash, dst_path):
+        """
+        Write the files of the given commit into the destination path, without any git metadata
+        """
+        self.ensure_commit(commit_hash)
+
+        dst_dir = Directory(dst_path)
+        if dst_dir.exists() and os.listdir(dst_dir.path):
+            raise EnvironmentError('Exporting commit {} into non empty directory {}'.format(commit_hash, dst_dir))
+        if not dst_dir.exists():
+            os.makedirs(dst_dir.path)
+
+        # A temporary index is used, so concurrent exports never share the mirror's index
+        index_dir = Directory(tempfile.mkdtemp(prefix=TEMP_DIR_PREFIX))
+        env = {'GIT_INDEX_FILE': index_dir.join('index').path, 'GIT_WORK_TREE': dst_dir.path}
+
+        try:
+            self._repo.git.read_tree(commit_hash, env=env)
+            self._repo.git.checkout_index('--all', '--force', env=env)
+        finally:
+            index_dir.delete()
@@ -6,8 +6,14 @@ from __future__ import print_function
 from .compat import appdata_dir_path
 from .combo_nodes import *
 from .source_types import *
-import json
+from .eviction import *
+from .metadata_store import *
+import os
 import tempfile
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
 
 
 class AppDataManuallyEdited(ComboException):
@@ -19,14 +25,70 @@ class AppDataCloneManuallyDeleted(AppDataManuallyEdited):
 
 
 class CachedData:
-    def __init__(self, clones_dir_name):
-        self._cache_size = 64 * 1024**2  # 64 MB
+    DEFAULT_CACHE_SIZE = 64 * 1024**2  # 64 MB
+    DEFAULT_EVICTION_POLICY = 'lru'
+    DEFAULT_METADATA_STORE = 'json'
+
+    def __init__(self, clones_dir_name, hash_memo=None, hash_algorithm=None, cache_size=None, eviction_policy=None,
+                 metadata_store=None):
+        self._cache_size = cache_size if cache_size is not None else self.DEFAULT_CACHE_SIZE
+        self._eviction_policy = EVICTION_POLICIES[eviction_policy or self.DEFAULT_EVICTION_POLICY]()
         self.appdata_dir = Directory(appdata_dir_path)
         self._clones_dir = self.appdata_dir.join(clones_dir_name)
+        self._hash_memo = hash_memo if hash_memo is not None else HashMemo()
 
-        # If the JSON file doesn't exist yet, create a default one
-        self._json_file_path = self.appdata_dir.join('local_projects.json').get_file(json.dumps(dict()))
-        self._cached_projects = JsonFile(self._json_file_path)
+        # New dependencies are hashed with this algorithm, existing ones keep the algorithm they were added with
+        self._hash_algorithm = hash_algorithm or DirectoryHasher.DEFAULT_ALGORITHM
+        DirectoryHasher(self._hash_algorithm)
+
+        # The cache may be shared by multiple processes, which coordinate using lock files
+        self._locks_dir = self.appdata_dir.join('locks')
+        self._use_locks = dict()
+
+        metadata_store_type = METADATA_STORES[metadata_store or self.DEFAULT_METADATA_STORE]
+        self._cached_projects = metadata_store_type(self.appdata_dir, self._locks_dir.join('local_projects.lock').path)
+
+        # Dependencies used by the current run are never evicted, and their access is recorded once
+        self._pinned = set()
+        self._touched = set()
+
+        # The used storage is summed from the metadata once it is needed, then maintained along with it
+        self._used_storage = None
+
+    def _lock_path(self, key):
+        return self._locks_dir.join(hashlib.sha1(key.encode()).hexdigest() + '.lock').path
+
+    def _fetch_lock(self, dep):
+        return FileLock(self._lock_path('fetch:' + str(dep)))
+
+    def refresh(self):
+        """
+        Read the metadata again, as other processes might have modified it
+        """
+        self._cached_projects.reload()
+        self._used_storage = None
+
+    @contextmanager
+    def locked(self, deps):
+        """
+        A context in which no other process checks, clones or removes any of the given dependencies.
+        Other processes waiting for the same dependencies find them cached once the context ends
+        """
+        # Locks are always acquired in the same order, so processes never wait for each other circularly
+        locks = [self._fetch_lock(dep_str) for dep_str in sorted(set(str(dep) for dep in deps))]
+
+        try:
+            for lock in locks:
+                lock.acquire()
+
+            self.refresh()
+            for dep in deps:
+                self._hash_memo.invalidate(self.dep_dir_path(dep))
+
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
 
     def dep_stored_data(self, dep):
         if str(dep) not in self._cached_projects:
@@ -43,6 +105,14 @@ class CachedData:
         assert self.has_dep(dep)
         return self._cached_projects[str(dep)]['hash']
 
+    def get_hash_algorithm(self, dep):
+        # Dependencies cached before the algorithm was recorded were hashed with the legacy algorithm
+        return self.dep_stored_data(dep).get('algorithm', DirectoryHasher.LEGACY_ALGORITHM)
+
+    def _hash_func(self, dep):
+        algorithm = self.get_hash_algorithm(dep)
+        return lambda directory: self._hash_memo.hash(directory, algorithm)
+
     def _validate_dep_param(self, dep, func, name):
         expected = self.dep_stored_data(dep)[name]
         found = func(self.dep_dir_path(dep))
@@ -56,7 +126,7 @@ class CachedData:
             raise AppDataManuallyEdited('Dependency {} does not exist'.format(dep))
 
         self._validate_dep_param(dep, len, 'size')
-        self._validate_dep_param(dep, hash, 'hash')
+        self._validate_dep_param(dep, self._hash_func(dep), 'hash')
 
         return True
 
@@ -65,98 +135,390 @@ class CachedData:
             raise AppDataCloneManuallyDeleted(dep)
 
         # Check directory hash matches to know the directory is valid
-        self._validate_dep_param(dep, hash, 'hash')
+        self._validate_dep_param(dep, self._hash_func(dep), 'hash')
 
         return self.dep_dir_path(dep)
 
+    def _source_referenced(self, source_digest):
+        return len(self._cached_projects.with_source(source_digest)) > 0
+
     def remove(self, dep):
-        # Delete the dependency's directory if it exists
-        self.dep_dir_path(dep).delete()
+        dep_dir = self.dep_dir_path(dep)
+        dep_data = self._cached_projects.get(str(dep), dict())
+        source_digest = dep_data.get('source')
 
-        # Remove the dependency from the json if exists and update the file
+        # Remove the dependency from the metadata if exists
         if str(dep) in self._cached_projects:
             self._cached_projects.pop(str(dep))
 
+        # Delete the dependency's directory if it exists, unless another dependency shares the same source
+        if source_digest is None or not self._source_referenced(source_digest):
+            dep_dir.delete()
+            self._hash_memo.invalidate(dep_dir)
+            if self._used_storage is not None:
+                self._used_storage -= dep_data.get('size', 0)
+
     def _get_used_storage(self):
-        return self._clones_dir.size()
+        if self._used_storage is None:
+            self._used_storage = self._cached_projects.used_storage()
+        return self._used_storage
+
+    def touch(self, dep):
+        """
+        Record an access to a cached dependency, once per run
+        """
+        if str(dep) in self._touched or str(dep) not in self._cached_projects:
+            return
+
+        dep_data = dict(self._cached_projects[str(dep)])
+        dep_data['last_access'] = time.time()
+        dep_data['access_count'] = dep_data.get('access_count', 0) + 1
+
+        self._cached_projects[str(dep)] = dep_data
+        self._touched.add(str(dep))
+
+        # Other processes must not evict a dependency while it is used
+        dep_dir_path = self.dep_dir_path(dep).path
+        if dep_dir_path not in self._use_locks:
+            self._use_locks[dep_dir_path] = FileLock(self._lock_path('use:' + dep_dir_path), shared=True)
+            self._use_locks[dep_dir_path].acquire()
+
+    def pin(self, dep):
+        self._pinned.add(str(dep))
+
+    def release(self):
+        """
+        Let other processes evict the dependencies used by this one
+        """
+        for lock in self._use_locks.values():
+            lock.release()
+        self._use_locks.clear()
+
+    def _evict(self, dep):
+        with self._fetch_lock(dep):
+            # A dependency used by any process, including this one, is not evicted
+            use_lock = FileLock(self._lock_path('use:' + self.dep_dir_path(dep).path))
+            if not use_lock.acquire(blocking=False):
+                return
+
+            try:
+                self.remove(dep)
+            finally:
+                use_lock.release()
+
+    def batch(self):
+        """
+        :return: A context in which all the modifications of the metadata are written to its file at once
+        """
+        return self._cached_projects
 
     def dep_dir_path(self, dep):
+        if str(dep) in self._cached_projects and 'source' in self._cached_projects[str(dep)]:
+            return self.source_dir_path(self._cached_projects[str(dep)]['source'])
+
+        # Dependencies cached before the content addressed store was used
         return self._clones_dir.join(dep.normalized_name_dir(), dep.normalized_version_dir())
 
-    def add(self, dep):
-        directory = self.dep_dir_path(dep)
-        self._cached_projects[str(dep)] = {'size': directory.size(), 'hash': hash(directory)}
+    def source_dir_path(self, source_digest):
+        return self._clones_dir.join('.store', source_digest)
+
+    def link_source(self, dep, source_digest):
+        """
+        Point the dependency to an existing valid clone of the same source, if any dependency cached it
+        :return: True if the dependency was linked
+        """
+        for dep_str in self._cached_projects.with_source(source_digest):
+            try:
+                self.valid(ComboDep.destring(dep_str))
+            except AppDataManuallyEdited:
+                return False
+
+            dep_data = dict(self._cached_projects[dep_str])
+            dep_data.pop('access_count', None)
+            self._cached_projects[str(dep)] = dep_data
+            self.touch(dep)
+            return True
+
+        return False
+
+    def add(self, dep, source_digest=None):
+        if source_digest is not None:
+            directory = self.source_dir_path(source_digest)
+            new_directory = len(self._cached_projects.with_source(source_digest)) == 0
+        else:
+            directory = self.dep_dir_path(dep)
+            new_directory = str(dep) not in self._cached_projects
+
+        dep_data = {
+            'size': directory.size(),
+            'hash': self._hash_memo.hash(directory, self._hash_algorithm),
+            'algorithm': self._hash_algorithm
+        }
+        if source_digest is not None:
+            dep_data['source'] = source_digest
+
+        if new_directory and self._used_storage is not None:
+            self._used_storage += dep_data['size']
+
+        self._cached_projects[str(dep)] = dep_data
+        self.touch(dep)
 
     def apply_limit(self):
         """
-        Delete dependencies from cache until the size limit is applicable
+        Delete dependencies from cache by the eviction policy until the size limit is applicable.
+        Pinned dependencies, and dependencies used by any running process are never deleted
         """
-        while self._get_used_storage() > self._cache_size:
-            dep_to_remove = ComboDep.destring(self._cached_projects.keys()[0])
-            self.remove(dep_to_remove)
+        self.refresh()
+
+        with self.batch():
+            for dep_str in self._eviction_policy.order(self._cached_projects):
+                if self._get_used_storage() <= self._cache_size:
+                    break
+                if dep_str not in self._pinned:
+                    self._evict(ComboDep.destring(dep_str))
+
+
+def fetch_source(fetch_job):
+    """
+    Fill a clone directory from its source. Defined on module level so it can run on a process pool as well.
+    :param fetch_job: A tuple of the dependency handler type, the import details and the clone directory
+    """
+    handler_type, import_details, clone_dir = fetch_job
+    import_handler = handler_type(import_details)
+
+    # A new clone directory is published by renaming once complete, so it is never found partially cloned
+    publish = not clone_dir.exists()
+    target_dir = Directory('{}.tmp{}.{}'.format(clone_dir, os.getpid(), threading.current_thread().ident)) \
+        if publish else clone_dir
+
+    try:
+        print('Cloning from {} into {}'.format(import_details, clone_dir))
+        if publish:
+            os.makedirs(target_dir.path)
+        import_handler.clone(target_dir)
+
+        if publish:
+            try:
+                os.rename(target_dir.path, clone_dir.path)
+            except EnvironmentError:
+                # Another process might have published a clone of the same source meanwhile
+                if not clone_dir.exists():
+                    raise
+                target_dir.delete()
+    except BaseException as e:
+        # Delete the imported dependency in case of error, don't leave a corrupted one
+        target_dir.delete()
+        raise e
+
+
+def try_fetch_source(fetch_job):
+    """
+    Fetch a source like fetch_source, without failing the other fetches running along with it.
+    :return: The error which failed the fetching, None if it succeeded
+    """
+    try:
+        fetch_source(fetch_job)
+    except (Exception, ComboException) as e:
+        return e
+    return None
+
+
+def fetch_file(fetch_job):
+    """
+    Fetch a single file from a source. Defined on module level so it can run on a process pool as well.
+    :param fetch_job: A tuple of the dependency handler type, the import details, the file name and the files directory
+    :return: The directory containing the file, None if the source has to be cloned for it
+    """
+    handler_type, import_details, file_name, files_dir = fetch_job
+    return handler_type(import_details).fetch_file(file_name, files_dir)
 
 
 class Importer(object):
-    def __init__(self, sources_locator, clones_dir_name='clones'):
+    FETCHED_FILES_MAX_AGE = 30 * 24 * 60 * 60  # Seconds
+
+    def __init__(self, sources_locator, clones_dir_name='clones', hash_memo=None, hash_algorithm=None,
+                 cache_size=None, eviction_policy=None, metadata_store=None, git_mirrors=True):
         """
         Construct a dependencies importer
         :param sources_locator: an implementation of the SourceLocator interface
+        :param hash_memo: an optional directory hashes memo shared with the importer's owner
+        :param hash_algorithm: the algorithm used to hash new cached dependencies, see DirectoryHasher
+        :param cache_size: the size limit of the cache in bytes
+        :param eviction_policy: the name of the cache eviction policy, see EVICTION_POLICIES
+        :param metadata_store: the name of the cache metadata store, see METADATA_STORES
+        :param git_mirrors: whether git dependencies are cloned from local mirrors of their remotes
         """
         self._handlers = {
-            'git': GitDependency,
+            'git': GitDependency if git_mirrors else DirectGitDependency,
             'file_system': FileSystemDependency
         }
         if not isinstance(sources_locator, SourceLocator):
             raise UnhandledComboException('Unsupported source locator type "{}"'.format(type(sources_locator)))
 
         self._source_locator = sources_locator
-        self._cached_data = CachedData(clones_dir_name)
+        self._hash_memo = hash_memo if hash_memo is not None else HashMemo()
+        self._cached_data = CachedData(clones_dir_name, self._hash_memo, hash_algorithm, cache_size, eviction_policy,
+                                       metadata_store)
+
+        # Sources located during this run, a dependency whose manifest was fetched alone is located once more
+        self._located_sources = dict()
+
+        # Single files fetched from the sources without cloning them, such as the manifests
+        self._files_dir = self._cached_data.appdata_dir.join('fetched_files')
 
     def _get_import_source(self, combo_dep):
         print('Checking the source of dependency {}'.format(combo_dep))
 
-        import_src = self._source_locator.get_source(*combo_dep.as_tuple())
+        import_src = self._located_sources.get(combo_dep) or self._source_locator.get_source(*combo_dep.as_tuple())
+        self._located_sources[combo_dep] = import_src
         if import_src['src_type'] not in self._handlers:
             raise NotImplementedError('Can not import dependency with source type "{}"'.format(import_src.src_type))
 
         return import_src
 
-    def clone(self, src):
-        if isinstance(src, ComboDep):
-            clone_dir = self._cached_data.dep_dir_path(src)
+    def _prefetch_sources(self, deps):
+        """
+        Locate the sources of the given dependencies which are not cached at once,
+        the sources locator may locate all of them in a single request
+        """
+        deps = [dep for dep in deps if dep not in self._located_sources and not self._cached_data.has_dep(dep)]
+        if len(deps) < 2:
+            return
 
-            # If the requested import already exists in metadata, ignore it
-            if clone_dir.exists():
-                try:
-                    self._cached_data.valid(src)
-                    return clone_dir
-                except AppDataManuallyEdited:
-                    self._cached_data.remove(src)
-                    clone_dir.delete()
+        sources = self._source_locator.get_sources([dep.as_tuple() for dep in deps])
+        self._located_sources.update(zip(deps, sources))
 
-            import_details = self._get_import_source(src)
-        else:
-            clone_dir = Directory(tempfile.mkdtemp())
-            import_details = src
+    def _clone_target(self, src):
+        """
+        :param src: A combo dependency, or the import details of a source
+        :return: A tuple of the clone directory, the import details required to fill it and the source digest.
+                 The import details are None if the clone directory is already cached and valid
+        """
+        if not isinstance(src, ComboDep):
+            return Directory(tempfile.mkdtemp(prefix=TEMP_DIR_PREFIX)), src, None
 
-        handler_type = self._handlers[import_details['src_type']]
-        import_handler = handler_type(import_details)
+        # If the requested import already exists in metadata, ignore it
+        if self._cached_data.dep_dir_path(src).exists():
+            try:
+                self._cached_data.valid(src)
+                self._cached_data.touch(src)
+                return self._cached_data.dep_dir_path(src), None, None
+            except AppDataManuallyEdited:
+                self._cached_data.remove(src)
 
-        try:
-            print('Cloning from {} into {}'.format(import_details, clone_dir))
-            import_handler.clone(clone_dir)
-        except BaseException as e:
-            # Delete the imported dependency in case of error, don't leave a corrupted one
-            clone_dir.delete()
-            raise e
+        import_details = self._get_import_source(src)
 
+        # Clones are stored by their source, so dependencies with the same source share a single clone
+        source_digest = self._handlers[import_details['src_type']](import_details).source_digest()
+        clone_dir = self._cached_data.source_dir_path(source_digest)
+
+        if self._cached_data.link_source(src, source_digest):
+            print('Dependency {} shares its source with an already cached dependency'.format(src))
+            return clone_dir, None, source_digest
+
+        # Leftovers of the source which are not referenced by any valid cached dependency
+        clone_dir.delete()
+        self._hash_memo.invalidate(clone_dir)
+
+        return clone_dir, import_details, source_digest
+
+    def _fetch_job(self, clone_dir, import_details):
+        return self._handlers[import_details['src_type']], import_details, clone_dir
+
+    def _cache_clone(self, src, source_digest):
         # Add the clone to the cache only if a combo dependency was passed
         if isinstance(src, ComboDep):
             print('Caching dependency {}'.format(src))
-            self._cached_data.add(src)
+            self._cached_data.add(src, source_digest)
+
+    def clone(self, src):
+        if isinstance(src, ComboDep):
+            return self.clone_all([src])[0]
+
+        clone_dir, import_details, _ = self._clone_target(src)
+        fetch_source(self._fetch_job(clone_dir, import_details))
 
         return clone_dir
 
+    def clone_all(self, deps, pool=None):
+        """
+        Clone multiple combo dependencies at once
+        :param deps: A list of combo dependencies
+        :param pool: An optional thread or process pool used to fetch the sources concurrently
+        :return: A list of the clone directories, ordered the same as the given dependencies
+        """
+        # Other processes wait for the dependencies until they are cloned and the cache metadata is written
+        with self._cached_data.locked(deps):
+            self._prefetch_sources(deps)
+
+            # The cache metadata of all the dependencies is written once
+            with self._cached_data.batch():
+                targets = list()
+                fetched_digests = dict()
+
+                for dep in deps:
+                    clone_dir, import_details, source_digest = self._clone_target(dep)
+
+                    # Multiple new dependencies of the same source are fetched only once
+                    if import_details is not None and source_digest in fetched_digests:
+                        import_details = None
+                        fetched_digests[source_digest].append(dep)
+                    elif import_details is not None:
+                        fetched_digests[source_digest] = list()
+
+                    targets.append((clone_dir, import_details, source_digest))
+
+                fetched_targets = [target for target in targets if target[1] is not None]
+                jobs = [self._fetch_job(clone_dir, import_details) for clone_dir, import_details, _ in fetched_targets]
+
+                # Only the fetching runs on the pool, the cache metadata is updated by this process alone
+                map_func = pool.map if pool is not None else map
+                try:
+                    errors = list(map_func(try_fetch_source, jobs))
+                finally:
+                    for _, _, clone_dir in jobs:
+                        self._hash_memo.invalidate(clone_dir)
+
+                # The finished clones are cached even if other fetches failed, so they are not fetched again
+                failed_digests = {source_digest for (_, _, source_digest), error in zip(fetched_targets, errors)
+                                  if error is not None}
+                for dep, (clone_dir, import_details, source_digest) in zip(deps, targets):
+                    if import_details is not None and source_digest not in failed_digests:
+                        self._cache_clone(dep, source_digest)
+                        for same_source_dep in fetched_digests[source_digest]:
+                            self._cached_data.link_source(same_source_dep, source_digest)
+
+                for error in errors:
+                    if error is not None:
+                        raise error
+
+                return [clone_dir for clone_dir, _, _ in targets]
+
+    def fetch_files(self, deps, file_name, pool=None):
+        """
+        Fetch a single file of multiple combo dependencies, such as their manifests.
+        Dependencies which are not cached are not cloned, unless their source can not provide the file alone
+        :param deps: A list of combo dependencies
+        :param pool: An optional thread or process pool used to fetch the files concurrently
+        :return: A list of the directories containing the file, ordered the same as the given dependencies
+        """
+        self._prefetch_sources(deps)
+
+        uncached = [dep for dep in deps if not self._cached_data.has_dep(dep)]
+        jobs = list()
+        for dep in uncached:
+            import_details = self._get_import_source(dep)
+            jobs.append((self._handlers[import_details['src_type']], import_details, file_name, self._files_dir))
+
+        map_func = pool.map if pool is not None else map
+        file_dirs = dict(zip(uncached, map_func(fetch_file, jobs)))
+
+        # Cached dependencies contain the file already, the rest are cloned for it
+        cloned = [dep for dep in deps if file_dirs.get(dep) is None]
+        file_dirs.update(zip(cloned, self.clone_all(cloned, pool)))
+
+        return [file_dirs[dep] for dep in deps]
+
     def get_dep_hash(self, dep):
         """
         :param dep: A combo dependency
@@ -170,17 +532,49 @@ class Importer(object):
         self.clone(dep)
         return self._cached_data.get_hash(dep)
 
+    def get_dep_hash_algorithm(self, dep):
+        """
+        :param dep: A combo dependency, which was already cached
+        :return: The algorithm of the dependency's hash
+        """
+        return self._cached_data.get_hash_algorithm(dep)
+
     def get_cached_path(self, dep):
         try:
             path = self._cached_data.cached_dependency_location(dep)
+            self._cached_data.touch(dep)
         except AppDataManuallyEdited:
-            self._cached_data.remove(dep)
+            # The dependency is checked again and replaced while locked
             path = self.clone(dep)
 
         return path
 
+    def pin(self, deps):
+        """
+        Make sure the given dependencies are not evicted from the cache during cleanup
+        """
+        for dep in deps:
+            self._cached_data.pin(dep)
+
+    def _prune_fetched_files(self):
+        if not self._files_dir.exists():
+            return
+
+        # The files of each source are kept together, their directory is touched whenever they are used
+        expiry_time = time.time() - self.FETCHED_FILES_MAX_AGE
+        for source_dir in self._files_dir.sons():
+            try:
+                if os.path.getmtime(source_dir.path) < expiry_time:
+                    source_dir.delete()
+            except EnvironmentError:
+                # Another process might have removed it meanwhile
+                pass
+
     def cleanup(self):
         self._cached_data.apply_limit()
+        self._cached_data.release()
+        self._prune_fetched_files()
+        HashIndex.prune()
 
 
 class SourceDetailsProvider:
@@ -1,6 +1,7 @@
 from combo_core import *
 from .combo_nodes import *
 import json
+import threading
 
 
 class ManifestNotFound(ComboException):
@@ -18,6 +19,7 @@ class ComboDependencyMismatch(ComboException):
 class Manifest:
     manifest_file_name = 'combo_manifest.json'
     output_dir_keyword = 'output_directory'
+    extern_mode_keyword = 'extern_mode'
 
     name_keyword = 'name'
     version_keyword = 'version'
@@ -27,6 +29,10 @@ class Manifest:
     dependency_name_keyword = 'name'
     required_dependency_keywords = [dependency_name_keyword]
 
+    # The parsed manifest files of this process by their paths, along with the file stat they were parsed at
+    _parsed_files = dict()
+    _parsed_files_lock = threading.Lock()
+
     def __init__(self, dir_path, expected_combo_node=None):
         """
         :param dir_path: The path to the combo manifest json file
@@ -39,8 +45,8 @@ class Manifest:
         if not os.path.exists(self.file_path):
             raise ManifestNotFound('"{}" is not a combo repository'.format(self.base_path))
 
-        with open(self.file_path, 'r') as f:
-            self.manifest = json.load(f)
+        # The parsed content is shared by all the manifests of the same file, it must not be modified
+        self.manifest = self._load(self.file_path)
 
         for kw in self.required_manifest_keywords:
             if kw not in self.manifest:
@@ -58,10 +64,30 @@ class Manifest:
 
         if self.valid_as_root():
             self.output_dir = self.base_path.join(self.manifest[self.output_dir_keyword])
+            self.extern_mode = self.manifest.get(self.extern_mode_keyword)
 
         if expected_combo_node is not False:
             self.validate(expected_combo_node if expected_combo_node is not None else dir_path.name())
 
+    @classmethod
+    def _load(cls, file_path):
+        """
+        :return: The parsed content of the manifest file, parsed again only if the file was modified
+        """
+        stat_key = stat_record(file_path)
+
+        with cls._parsed_files_lock:
+            parsed = cls._parsed_files.get(file_path)
+        if parsed is not None and parsed[0] == stat_key:
+            return parsed[1]
+
+        with open(file_path, 'r') as f:
+            content = json.load(f)
+
+        with cls._parsed_files_lock:
+            cls._parsed_files[file_path] = (stat_key, content)
+        return content
+
     def validate(self, expected):
         if isinstance(expected, string_types):
             if ComboDep.normalize_name_dir(self.name) != expected:
@@ -80,14 +106,8 @@ class Manifest:
 
     @staticmethod
     def is_combo_repo(dir_path):
-        try:
-            Manifest(dir_path)
-            return True
-        except ManifestNotFound:
-            return False
-        # The rest of the exceptions wouldn't mean that this is not a combo repository
-        except ComboException:
-            return True
+        # Only a missing manifest means that this is not a combo repository, an invalid one doesn't
+        return os.path.exists(dir_path.join(Manifest.manifest_file_name).path)
 
     def sons(self):
         return list(self.dependencies.values())
@@ -100,7 +120,7 @@ class Manifest:
 
     def __eq__(self, other):
         assert isinstance(other, type(self))
-        return dicts_equal(self.manifest, other.manifest)
+        return self.manifest is other.manifest or dicts_equal(self.manifest, other.manifest)
 
     def __ne__(self, other):
         return not self == other
@@ -0,0 +1,224 @@
+"""
+Stores of the cached dependencies metadata, by the string representation of each dependency
+"""
+
+from .combo_nodes import *
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class JsonMetadataStore(JsonFile):
+    """
+    Keeps the whole metadata in a single JSON file, which is read completely and rewritten on every modification
+    """
+    def __init__(self, appdata_dir, lock_path):
+        # If the JSON file doesn't exist yet, create a default one
+        json_file_path = appdata_dir.join('local_projects.json').get_file(json.dumps(dict()))
+        super(JsonMetadataStore, self).__init__(json_file_path, compact=True, lock_path=lock_path)
+
+    def with_source(self, source_digest):
+        """
+        :return: The strings of the dependencies cached from the given source
+        """
+        return [dep_str for dep_str, data in self.items() if data.get('source') == source_digest]
+
+    def used_storage(self):
+        """
+        :return: The total size of the cached directories, directories shared by multiple dependencies count once
+        """
+        sizes = {data.get('source', dep_str): data['size'] for dep_str, data in self.items()}
+        return sum(sizes.values())
+
+
+class SqliteMetadataStore(object):
+    """
+    Keeps the metadata in an indexed SQLite database, so only the looked up dependencies are read.
+    The metadata of the JSON store is migrated into the database once, when it is created
+    """
+    COLUMNS = ('size', 'hash', 'algorithm', 'source', 'last_access', 'access_count')
+    TIMEOUT = 60
+
+    TABLE_SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS dependencies (
+            dep TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            version TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            hash NOT NULL,
+            algorithm TEXT,
+            source TEXT,
+            last_access REAL,
+            access_count INTEGER
+        )'''
+
+    def __init__(self, appdata_dir, lock_path):
+        """
+        :param lock_path: The path of a lock file, held by a single process while creating or migrating the database
+        """
+        self.db_path = appdata_dir.join('local_projects.db').path
+
+        # The connection is shared by the threads fetching dependencies, which use it one at a time
+        self._lock = threading.RLock()
+
+        if not appdata_dir.exists():
+            try:
+                os.makedirs(appdata_dir.path)
+            except EnvironmentError:
+                # Another process might have created the directory meanwhile
+                if not appdata_dir.exists():
+                    raise
+
+        # Switching to the write ahead log fails while another process uses the database, so it is done under the lock
+        with FileLock(lock_path):
+            # Every modification is committed on its own, other processes wait for it to be committed.
+            # The write ahead log keeps these commits cheap, and lets readers run while writing
+            self._connection = sqlite3.connect(self.db_path, timeout=self.TIMEOUT, isolation_level=None,
+                                               check_same_thread=False)
+            self._execute('PRAGMA journal_mode=WAL')
+            self._execute('PRAGMA synchronous=NORMAL')
+
+            with self._transaction():
+                # The hash column has no type affinity, so hashes are read back with the type they were written with
+                self._execute(self.TABLE_SCHEMA)
+                self._migrate_hash_affinity()
+                self._execute('CREATE INDEX IF NOT EXISTS dependencies_name ON dependencies (name, version)')
+                self._execute('CREATE INDEX IF NOT EXISTS dependencies_source ON dependencies (source)')
+                self._execute('CREATE INDEX IF NOT EXISTS dependencies_access ON dependencies (last_access)')
+                self._execute('CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)')
+
+                self._migrate_json(appdata_dir)
+
+    def _execute(self, sql, parameters=()):
+        """
+        :return: All the rows of the statement's result
+        """
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._execute('ROLLBACK')
+                raise
+            self._execute('COMMIT')
+
+    def _migrate_hash_affinity(self):
+        # Databases created with a textual hash column kept the integer hashes of the legacy algorithm as text
+        columns = self._execute('PRAGMA table_info(dependencies)')
+        if not any(column[1] == 'hash' and column[2] for column in columns):
+            return
+
+        self._execute('ALTER TABLE dependencies RENAME TO typed_dependencies')
+        self._execute(self.TABLE_SCHEMA)
+        self._execute('''
+            INSERT INTO dependencies
+            SELECT dep, name, version, size,
+                   CASE WHEN COALESCE(algorithm, ?) = ? THEN CAST(hash AS INTEGER) ELSE hash END,
+                   algorithm, source, last_access, access_count
+            FROM typed_dependencies''', (DirectoryHasher.LEGACY_ALGORITHM, DirectoryHasher.LEGACY_ALGORITHM))
+        self._execute('DROP TABLE typed_dependencies')
+
+    def _migrate_json(self, appdata_dir):
+        json_file_path = appdata_dir.join('local_projects.json').path
+        if self._execute('SELECT 1 FROM migrations WHERE name = ?', ('json',)):
+            return
+
+        if os.path.isfile(json_file_path):
+            with open(json_file_path, 'r') as f:
+                for dep_str, data in json.load(f).items():
+                    if dep_str not in self:
+                        self[dep_str] = data
+
+        # The JSON file is left as is, so an older version of combo may still use it
+        self._execute('INSERT INTO migrations (name) VALUES (?)', ('json',))
+
+    def _row_data(self, row):
+        return {column: value for column, value in zip(self.COLUMNS, row) if value is not None}
+
+    def reload(self):
+        # The database is always read directly
+        pass
+
+    def with_source(self, source_digest):
+        rows = self._execute('SELECT dep FROM dependencies WHERE source = ?', (source_digest,))
+        return [dep_str for dep_str, in rows]
+
+    def used_storage(self):
+        rows = self._execute('''
+            SELECT SUM(size) FROM (
+                SELECT MAX(size) AS size FROM dependencies GROUP BY COALESCE(source, dep)
+            )''')
+        return rows[0][0] or 0
+
+    def __contains__(self, dep_str):
+        return len(self._execute('SELECT 1 FROM dependencies WHERE dep = ?', (dep_str,))) > 0
+
+    def __getitem__(self, dep_str):
+        rows = self._execute('SELECT {} FROM dependencies WHERE dep = ?'.format(', '.join(self.COLUMNS)), (dep_str,))
+        if not rows:
+            raise KeyError(dep_str)
+        return self._row_data(rows[0])
+
+    def get(self, dep_str, default=None):
+        try:
+            return self[dep_str]
+        except KeyError:
+            return default
+
+    def __setitem__(self, dep_str, data):
+        dep = ComboDep.destring(dep_str)
+        values = [data.get(column) for column in self.COLUMNS]
+        self._execute(
+            'INSERT OR REPLACE INTO dependencies (dep, name, version, {}) VALUES (?, ?, ?, {})'.format(
+                ', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS))),
+            [dep_str, dep.name, str(dep.version)] + values)
+
+    def __delitem__(self, dep_str):
+        self._execute('DELETE FROM dependencies WHERE dep = ?', (dep_str,))
+
+    def pop(self, dep_str, *default):
+        with self._lock:
+            if dep_str not in self:
+                if default:
+                    return default[0]
+                raise KeyError(dep_str)
+
+            data = self[dep_str]
+            del self[dep_str]
+            return data
+
+    def items(self):
+        rows = self._execute('SELECT dep, {} FROM dependencies'.format(', '.join(self.COLUMNS)))
+        return [(row[0], self._row_data(row[1:])) for row in rows]
+
+    def keys(self):
+        return [dep_str for dep_str, in self._execute('SELECT dep FROM dependencies')]
+
+    def values(self):
+        return [data for _, data in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __enter__(self):
+        # The database is not kept locked during a batch, which may last while dependencies are cloned
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __str__(self):
+        return self.db_path
+
+
+METADATA_STORES = {
+    'json': JsonMetadataStore,
+    'sqlite': SqliteMetadataStore
+}
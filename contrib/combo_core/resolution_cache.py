@@ -0,0 +1,92 @@
+"""
+Keeps the dependencies resolved for each root manifest, so they are not resolved again while nothing changed
+"""
+
+from .compat import appdata_dir_path
+from .combo_nodes import *
+from .manifest import *
+import os
+import json
+import hashlib
+
+
+class ResolutionCache(object):
+    """
+    A resolution is reused while the root manifest and the sources index revision are the same,
+    and none of the manifests read while resolving it was modified.
+
+    The sources of the dependencies are not part of the key, as the sources index revision covers all of them.
+    The content of sources which change without the index, such as local directories, is covered by the
+    stat of their manifests, so a changed manifest resolves the dependencies again
+    """
+    def __init__(self, resolutions_dir=None):
+        self._resolutions_dir = Directory(resolutions_dir or os.path.join(appdata_dir_path, 'resolutions'))
+
+    def _record_path(self, base_manifest):
+        record_name = hashlib.md5(os.path.abspath(base_manifest.file_path).encode()).hexdigest() + '.json'
+        return self._resolutions_dir.join(record_name).path
+
+    @staticmethod
+    def _key(base_manifest, sources_revision):
+        key_details = json.dumps([base_manifest.manifest, sources_revision], sort_keys=True)
+        return hashlib.sha1(key_details.encode()).hexdigest()
+
+    def load(self, base_manifest, sources_revision):
+        """
+        :param base_manifest: The root manifest
+        :param sources_revision: The revision of the sources index, None if it is unknown
+        :return: The previously resolved dependencies and the manifest of each dependency read while resolving them,
+                 None if they have to be resolved again
+        """
+        if sources_revision is None:
+            return None
+
+        try:
+            with open(self._record_path(base_manifest), 'r') as f:
+                record = json.load(f)
+
+            if record['key'] != self._key(base_manifest, sources_revision):
+                return None
+
+            manifests = dict()
+            for dep_str, file_path, recorded_stat in record['manifests']:
+                if stat_record(file_path) != recorded_stat:
+                    return None
+
+                dep = ComboDep.destring(dep_str)
+                manifests[dep] = Manifest(Directory(os.path.dirname(file_path)), dep)
+
+            return [ComboDep.destring(dep_str) for dep_str in record['dependencies']], manifests
+        except (EnvironmentError, ValueError, KeyError, ComboException):
+            # A missing manifest, or a missing or broken record, means the dependencies are resolved again
+            return None
+
+    def store(self, base_manifest, sources_revision, manifests, dependencies):
+        """
+        :param manifests: The manifest of each dependency read while resolving the dependencies
+        :param dependencies: The resolved dependencies
+        """
+        if sources_revision is None:
+            return
+
+        record = {
+            'key': self._key(base_manifest, sources_revision),
+            'manifests': [[str(dep), manifest.file_path, stat_record(manifest.file_path)]
+                          for dep, manifest in manifests.items()],
+            'dependencies': sorted(str(dep) for dep in dependencies)
+        }
+
+        # Written to a temporary file first, so a partially written record is never read
+        record_path = self._record_path(base_manifest)
+        if not self._resolutions_dir.exists():
+            try:
+                os.makedirs(self._resolutions_dir.path)
+            except EnvironmentError:
+                # Another process might have created the directory meanwhile
+                if not self._resolutions_dir.exists():
+                    raise
+
+        temp_path = record_path + '.tmp{}'.format(os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(record, f, separators=(',', ':'))
+        replace_file(temp_path, record_path)
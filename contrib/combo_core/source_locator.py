@@ -1,6 +1,7 @@
 from combo_core import *
 import json
 import copy
+import hashlib
 
 
 class UndefinedProject(ComboException):
@@ -107,6 +108,19 @@ class SourceLocator(object):
     def get_source(self, project_name, version):
         raise NotImplementedError()
 
+    def get_sources(self, project_versions):
+        """
+        :param project_versions: A list of (project name, version) tuples
+        :return: A list of the sources, ordered the same as the given project versions
+        """
+        return [self.get_source(project_name, version) for project_name, version in project_versions]
+
+    def revision(self):
+        """
+        :return: A value which changes whenever any of the sources changes, None if it can not be known
+        """
+        return None
+
 
 class IndexerSourceHandler(object):
     IDENTIFIER_TYPE_KEYWORD = 'general_type'
@@ -130,6 +144,12 @@ class IndexerSourceHandler(object):
     def get_json_file_path(self):
         return str(self._projects)
 
+    def batch(self):
+        """
+        :return: A context in which all the modifications of the sources index are written to its file at once
+        """
+        return self._projects
+
 
 class IndexerSourceLocator(IndexerSourceHandler, SourceLocator):
     def __init__(self, json_path):
@@ -152,3 +172,7 @@ class IndexerSourceLocator(IndexerSourceHandler, SourceLocator):
         source_supplier = source_supplier_type(project_name, project_details)
         source = source_supplier.get_source(str(version))
         return source.as_dict()
+
+    def revision(self):
+        # The whole index is already loaded, so its digest is cheap
+        return hashlib.sha1(json.dumps(self._projects, sort_keys=True).encode()).hexdigest()
@@ -16,6 +16,13 @@ class SourceMaintainer(SourceLocator):
     def add_version(self, version_details, **kwargs):
         raise NotImplementedError()
 
+    def add_versions(self, versions_details):
+        """
+        :param versions_details: The details of each added version, its name and version are read from its manifest
+        :return: The combo dependencies of the added versions
+        """
+        return [self.add_version(version_details) for version_details in versions_details]
+
 
 class IndexerSourceMaintainer(IndexerSourceLocator, SourceMaintainer):
     def __init__(self, json_path, **kwargs):
@@ -80,3 +87,8 @@ class IndexerSourceMaintainer(IndexerSourceLocator, SourceMaintainer):
 
         return dep_details
 
+    def add_versions(self, versions_details):
+        # The sources index is written once, after all the versions were added
+        with self.batch():
+            return super(IndexerSourceMaintainer, self).add_versions(versions_details)
+
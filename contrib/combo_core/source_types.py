@@ -1,5 +1,9 @@
 from combo_core import *
 from .source_locator import *
+import os
+import hashlib
+import json
+import threading
 
 '''
     Interfaces
@@ -14,9 +18,27 @@ class DependencyBase(object):
         for keyword in keywords:
             assert keyword in self.dep_src, 'Invalid import source, missing attribute "{}"'.format(keyword)
 
+    def _digest_details(self):
+        return dict(self.dep_src)
+
+    def source_digest(self):
+        """
+        :return: A stable digest of the source, the same for every dependency importing the same content
+        """
+        digest_details = json.dumps(self._digest_details(), sort_keys=True)
+        return hashlib.sha1(digest_details.encode()).hexdigest()
+
     def clone(self, dst_path):
         raise NotImplementedError()
 
+    def fetch_file(self, file_name, files_dir):
+        """
+        Fetch a single file of the source, without cloning all of it
+        :param files_dir: A directory in which fetched files may be stored by the source digest
+        :return: The directory containing the file, None if the source has to be cloned for it
+        """
+        return None
+
 
 class DetailsProviderBase(object):
     def __init__(self, working_dir):
@@ -49,11 +71,19 @@ class GitDetailsKeywords(object):
 
 
 class GitDependency(DependencyBase, GitDetailsKeywords):
+    # Clone from a local mirror of each remote, so the history is downloaded once for all versions
+    use_mirrors = True
+
     def clone(self, dst_path):
         from combo_core import git_api
 
         self.assert_keywords(*self.required_keywords)
 
+        if self.use_mirrors:
+            mirror = git_api.GitMirror(self.dep_src[self.remote_url_keyword])
+            mirror.export(self.dep_src[self.commit_hash_keyword], dst_path)
+            return
+
         # Clone the dependency
         repo = git_api.GitRepo(dst_path)
 
@@ -66,6 +96,47 @@ class GitDependency(DependencyBase, GitDetailsKeywords):
 
         repo.close()
 
+    def fetch_file(self, file_name, files_dir):
+        from combo_core import git_api
+
+        self.assert_keywords(*self.required_keywords)
+
+        if not self.use_mirrors:
+            return None
+
+        # The files of a commit never change, so a fetched file is kept for the following runs
+        file_dir = files_dir.join(self.source_digest())
+        if file_dir.join(file_name).exists():
+            # Fetched files which are not used for a while are removed, see Importer.cleanup
+            os.utime(file_dir.path, None)
+            return file_dir
+
+        mirror = git_api.GitMirror(self.dep_src[self.remote_url_keyword])
+        content = mirror.read_file(self.dep_src[self.commit_hash_keyword], file_name)
+        if content is None:
+            return None
+
+        if not file_dir.exists():
+            try:
+                os.makedirs(file_dir.path)
+            except EnvironmentError:
+                # Another process might have created the directory meanwhile
+                if not file_dir.exists():
+                    raise
+
+        # Written into a temporary file first, so a partially written file is never found
+        temp_path = file_dir.join(file_name).path + '.tmp{}.{}'.format(os.getpid(), threading.current_thread().ident)
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        replace_file(temp_path, file_dir.join(file_name).path)
+
+        return file_dir
+
+
+class DirectGitDependency(GitDependency):
+    # Clone each version straight from its remote, fetching only the commit of the version
+    use_mirrors = False
+
 
 class GitDetailsProvider(DetailsProviderBase, GitDetailsKeywords):
     def get_type(self):
@@ -91,6 +162,19 @@ class NonExistingPath(ComboException):
 class FileSystemDependency(DependencyBase):
     PATH_KEYWORD = 'path'
 
+    def _digest_details(self):
+        self.assert_keywords(self.PATH_KEYWORD)
+
+        # The content of a local path may change, so it is a part of the source
+        src_path = Directory(self.dep_src[self.PATH_KEYWORD])
+        if not src_path.exists():
+            raise NonExistingPath('Local path {} does not exist'.format(src_path))
+
+        return {
+            self.PATH_KEYWORD: src_path.abs(),
+            'hash': src_path.get_hash(DirectoryHasher.DEFAULT_ALGORITHM)
+        }
+
     def clone(self, dst_path):
         self.assert_keywords(self.PATH_KEYWORD)
 
@@ -100,6 +184,16 @@ class FileSystemDependency(DependencyBase):
 
         Directory(src_path).copy_to(dst_path)
 
+    def fetch_file(self, file_name, files_dir):
+        self.assert_keywords(self.PATH_KEYWORD)
+
+        # Local files are read directly from the source
+        src_path = Directory(self.dep_src[self.PATH_KEYWORD])
+        if not src_path.exists():
+            raise NonExistingPath('Local path {} does not exist'.format(src_path))
+
+        return src_path
+
 
 class FileSystemDetailsProvider(DetailsProviderBase):
     TYPE_NAME = 'file_system'
@@ -3,6 +3,14 @@ import hashlib
 import stat
 import shutil
 import json
+import mmap
+import time
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+# Temporary directories of combo are created with this prefix, their hashes are never indexed
+TEMP_DIR_PREFIX = 'combo_tmp_'
 
 
 class ObjectNotFound(LookupError):
@@ -17,7 +25,17 @@ class ActionOnNonexistingDirectory(EnvironmentError):
     pass
 
 
+class DirectoryDiff(namedtuple('DirectoryDiff', ('added', 'removed', 'changed'))):
+    """
+    The relative paths of the files added, removed and changed in a directory, compared to another one
+    """
+    def empty(self):
+        return not (self.added or self.removed or self.changed)
+
+
 class Directory(object):
+    COMPARE_BUFFER_SIZE = 64 * 1024
+
     def __init__(self, path):
         self.path = path.path if isinstance(path, type(self)) else os.path.abspath(path)
 
@@ -59,9 +77,13 @@ class Directory(object):
         assert not os.path.isdir(self.path), 'Requested to get directory {} as file'.format(self.path)
         return self.path
 
-    def copy_to(self, dst, symlinks=False, ignore=None):
+    def copy_to(self, dst, symlinks=False, ignore=None, copy_function=None):
+        """
+        :param copy_function: An optional function used to copy each file instead of shutil.copy2
+        """
         if not self.exists():
             raise ActionOnNonexistingDirectory(self.path)
+        assert copy_function is None or ignore is None, 'Ignoring files is not supported with a copy function'
 
         dst_path = dst.path if isinstance(dst, type(self)) else dst
 
@@ -71,13 +93,35 @@ class Directory(object):
 
             s = os.path.join(self.path, item)
             d = os.path.join(dst_path, item)
-            if os.path.isdir(s):
+            if copy_function is not None:
+                if symlinks and os.path.islink(s):
+                    os.symlink(os.readlink(s), d)
+                elif os.path.isdir(s):
+                    os.makedirs(d)
+                    Directory(s).copy_to(d, symlinks, ignore, copy_function)
+                else:
+                    copy_function(s, d)
+            elif os.path.isdir(s):
                 shutil.copytree(s, d, symlinks, ignore)
             else:
                 shutil.copy2(s, d)
 
         return Directory(dst_path)
 
+    def symlink_to(self, dst):
+        if not self.exists():
+            raise ActionOnNonexistingDirectory(self.path)
+
+        dst_path = dst.path if isinstance(dst, type(self)) else dst
+        if not os.path.exists(os.path.dirname(dst_path)):
+            os.makedirs(os.path.dirname(dst_path))
+
+        os.symlink(self.path, dst_path)
+        return Directory(dst_path)
+
+    def is_link(self):
+        return os.path.islink(self.path)
+
     def size(self):
         total_size = 0
 
@@ -87,14 +131,179 @@ class Directory(object):
                 total_size += os.path.getsize(fp)
         return total_size
 
+    def files(self):
+        """
+        :return: The relative and full paths of all the files under the directory, in walking order
+        """
+        listed_files = list()
+
+        for root, dirs, files in os.walk(self.path):
+            # This is sorted for determined results between all platforms, must be sorted here
+            dirs.sort()
+            files.sort()
+
+            for names in files:
+                file_path = os.path.join(root, names)
+                listed_files.append((os.path.relpath(file_path, self.path), file_path))
+
+        return listed_files
+
+    @classmethod
+    def _same_content(cls, src_file, dst_file, src_digest, dst_digest):
+        # A matching modification time alone does not mean an unmodified file
+        if os.path.getsize(src_file) != os.path.getsize(dst_file):
+            return False
+        return not cls._files_differ(src_file, dst_file, src_digest, dst_digest)
+
+    def sync_to(self, dst, copy_function=None, algorithm=None):
+        """
+        Make the destination directory identical to this one, writing only the files which differ.
+        Files are compared by their size first, then by their indexed digests, and by their content otherwise.
+        :param copy_function: An optional function used to copy each file instead of shutil.copy2
+        :param algorithm: The algorithm of the hash indexes used to compare files
+        :return: The relative paths of the added, changed and removed files
+        """
+        if not self.exists():
+            raise ActionOnNonexistingDirectory(self.path)
+
+        copy_function = copy_function or shutil.copy2
+        dst = Directory(dst)
+
+        src_files = dict(self.files())
+        dst_files = dict(dst.files()) if dst.exists() else dict()
+
+        algorithm = algorithm or DirectoryHasher.LEGACY_ALGORITHM
+        src_index = HashIndex.of_directory(self, algorithm)
+        dst_index = HashIndex.of_directory(dst, algorithm)
+
+        def indexed_digest(index, rel_path, file_path):
+            return index.file_digest(rel_path, stat_record(file_path)) if index is not None else None
+
+        added, changed, removed = list(), list(), list()
+
+        for rel_path in sorted(set(dst_files) - set(src_files)):
+            remove_file(dst_files[rel_path])
+            removed.append(rel_path)
+
+        for root, dirs, files in os.walk(self.path):
+            dst_root = os.path.join(dst.path, os.path.relpath(root, self.path))
+            if os.path.isfile(dst_root) or os.path.islink(dst_root):
+                remove_file(dst_root)
+            if not os.path.isdir(dst_root):
+                os.makedirs(dst_root)
+
+        for rel_path in sorted(src_files):
+            src_file = src_files[rel_path]
+            dst_file = os.path.join(dst.path, rel_path)
+
+            if rel_path in dst_files:
+                if self._same_content(src_file, dst_file, indexed_digest(src_index, rel_path, src_file),
+                                      indexed_digest(dst_index, rel_path, dst_file)):
+                    continue
+
+                # Never write into the existing file, as it might be linked to another cached clone
+                remove_file(dst_file)
+                changed.append(rel_path)
+            else:
+                if os.path.isdir(dst_file):
+                    Directory(dst_file).delete()
+                added.append(rel_path)
+
+            copy_function(src_file, dst_file)
+
+        # Remove the directories which do not exist on the source anymore
+        for root, dirs, files in os.walk(dst.path, topdown=False):
+            for name in dirs:
+                dir_path = os.path.join(root, name)
+                if not os.path.isdir(os.path.join(self.path, os.path.relpath(dir_path, dst.path))):
+                    Directory(dir_path).delete()
+
+        return added, changed, removed
+
+    @classmethod
+    def _files_differ(cls, file_path, other_file_path, file_digest=None, other_file_digest=None):
+        if os.path.samestat(os.stat(file_path), os.stat(other_file_path)):
+            return False
+        if file_digest is not None and other_file_digest is not None:
+            return file_digest != other_file_digest
+
+        with open(file_path, 'rb') as f, open(other_file_path, 'rb') as other_f:
+            for buf in iter(lambda: f.read(cls.COMPARE_BUFFER_SIZE), b''):
+                if buf != other_f.read(len(buf)):
+                    return True
+            return other_f.read(1) != b''
+
+    def compare(self, other, algorithm=None, early_exit=False):
+        """
+        Compare the files of another directory to this one, by the cheapest signals first:
+        the file lists, the file sizes, the indexed digests, and the content chunk by chunk otherwise.
+        :param algorithm: The algorithm of the hash indexes used to compare files, None to compare the content alone
+        :param early_exit: Stop at the first difference, which is the only one in the returned diff
+        :return: A DirectoryDiff of the files added, removed and changed in the other directory
+        """
+        other = Directory(other)
+        for directory in (self, other):
+            if not directory.exists():
+                raise ActionOnNonexistingDirectory(directory.path)
+
+        diff = DirectoryDiff(list(), list(), list())
+
+        # A linked directory is the same as its target
+        if os.path.realpath(self.path) == os.path.realpath(other.path):
+            return diff
+
+        files = dict(self.files())
+        other_files = dict(other.files())
+
+        for rel_path in sorted(set(other_files) - set(files)):
+            diff.added.append(rel_path)
+            if early_exit:
+                return diff
+        for rel_path in sorted(set(files) - set(other_files)):
+            diff.removed.append(rel_path)
+            if early_exit:
+                return diff
+
+        # All the sizes are compared before reading any of the files
+        common_files = list()
+        for rel_path in sorted(set(files) & set(other_files)):
+            if os.path.getsize(files[rel_path]) != os.path.getsize(other_files[rel_path]):
+                diff.changed.append(rel_path)
+                if early_exit:
+                    return diff
+            else:
+                common_files.append(rel_path)
+
+        index = HashIndex.of_directory(self, algorithm) if algorithm is not None else None
+        other_index = HashIndex.of_directory(other, algorithm) if algorithm is not None else None
+
+        def indexed_digest(hash_index, rel_path, file_path):
+            if hash_index is None:
+                return None
+            return hash_index.file_digest(rel_path, stat_record(file_path))
+
+        for rel_path in common_files:
+            file_path, other_file_path = files[rel_path], other_files[rel_path]
+            if self._files_differ(file_path, other_file_path, indexed_digest(index, rel_path, file_path),
+                                  indexed_digest(other_index, rel_path, other_file_path)):
+                diff.changed.append(rel_path)
+                if early_exit:
+                    return diff
+
+        diff.changed.sort()
+        return diff
+
     def delete(self):
+        # A linked directory is only unlinked, its target is left untouched
+        if self.is_link():
+            os.remove(self.path)
+            return
+
         if not self.exists():
             return
         for root, dirs, files in os.walk(self.path, topdown=False):
             for name in files:
-                filename = os.path.join(root, name)
-                os.chmod(filename, stat.S_IWUSR)
-                os.remove(filename)
+                remove_file(os.path.join(root, name))
             for name in dirs:
                 os.rmdir(os.path.join(root, name))
         os.rmdir(self.path)
@@ -105,68 +314,572 @@ class Directory(object):
     def relative_to(self, other):
         return os.path.relpath(self.path, other.path)
 
-    def get_hash(self):
-        sha_hash = hashlib.md5()
-        
-        if not self.exists():
-            raise ActionOnNonexistingDirectory(self.path)
-
-        for root, dirs, files in os.walk(self.path):
-            # This is sorted for determined results between all platforms, must be sorted here
-            dirs.sort()
-            files.sort()
-
-            for names in files:
-                file_path = os.path.join(root, names)
-                path_to_hash = os.path.relpath(file_path, self.path)
-                sha_hash.update(path_to_hash.encode())
-
-                with open(file_path, 'rb') as f:
-                    for buf in iter(lambda: f.read(4096), b''):
-                        sha_hash.update(buf)
-
-        return sha_hash.hexdigest()
+    def get_hash(self, algorithm=None, workers=None):
+        return DirectoryHasher(algorithm, workers).hash(self)
+
+    def hash_value(self, algorithm=None, workers=None):
+        """
+        :param workers: Amount of files hashed concurrently, see DirectoryHasher
+        :return: The hash of the directory as kept in the cache metadata.
+                 The legacy algorithm is masked for compatibility with existing caches
+        """
+        algorithm = algorithm or DirectoryHasher.LEGACY_ALGORITHM
+        if algorithm == DirectoryHasher.LEGACY_ALGORITHM:
+            # Masking the result to the limit of python's __hash__ function
+            return int(self.get_hash(algorithm, workers), 16) & 0x7FFFFFFF
+        return self.get_hash(algorithm, workers)
 
     def __hash__(self):
-        # Masking the result to the limit of python's __hash__ function
-        return int(self.get_hash(), 16) & 0x7FFFFFFF
+        return self.hash_value()
 
     def __str__(self):
         return self.path
 
     def __eq__(self, other):
         assert isinstance(other, type(self))
-        return hash(self) == hash(other)
+        return self.compare(other, early_exit=True).empty()
 
     def __ne__(self, other):
         return not self == other
 
 
+class DirectoryHasher(object):
+    """
+    Hashes the files of a directory together with their relative paths.
+    The legacy algorithm hashes all the files as a single stream, for compatibility with existing caches.
+    The rest of the algorithms hash the files separately on a thread pool,
+    then combine the file digests in sorted paths order.
+    """
+    LEGACY_ALGORITHM = 'md5'
+    ALGORITHMS = ('md5', 'sha256', 'blake2b')
+    DEFAULT_ALGORITHM = 'blake2b' if 'blake2b' in getattr(hashlib, 'algorithms_guaranteed', ()) else 'sha256'
+
+    BUFFER_SIZE = 1024 ** 2
+    MMAP_MIN_SIZE = 16 * 1024 ** 2
+
+    # Default amount of files hashed concurrently, hashlib releases the GIL while hashing
+    workers = 8
+
+    def __init__(self, algorithm=None, workers=None):
+        """
+        :param workers: Amount of files hashed concurrently, 1 for hashers which already run concurrently
+        """
+        self.algorithm = algorithm or self.LEGACY_ALGORITHM
+        self.workers = workers or self.workers
+
+        if self.algorithm not in self.ALGORITHMS:
+            raise ValueError('Unsupported hash algorithm "{}"'.format(self.algorithm))
+        self._new_hash()
+
+    def _new_hash(self):
+        return hashlib.new(self.algorithm)
+
+    @classmethod
+    def _read_buffers(cls, file_path):
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < cls.MMAP_MIN_SIZE:
+                for buf in iter(lambda: f.read(cls.BUFFER_SIZE), b''):
+                    yield buf
+                return
+
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def hash_file(self, file_path):
+        file_hash = self._new_hash()
+        for buf in self._read_buffers(file_path):
+            file_hash.update(buf)
+        return file_hash.hexdigest()
+
+    def _stream_hash(self, listed_files, file_digests):
+        """
+        The legacy directory hash, a single hash of all the relative paths and contents in walking order.
+        The digests of the files themselves are only calculated for files missing a digest.
+        """
+        sha_hash = self._new_hash()
+
+        for i, (path_to_hash, file_path) in enumerate(listed_files):
+            sha_hash.update(path_to_hash.encode())
+            file_hash = self._new_hash() if file_digests[i] is None else None
+
+            for buf in self._read_buffers(file_path):
+                sha_hash.update(buf)
+                if file_hash is not None:
+                    file_hash.update(buf)
+
+            if file_hash is not None:
+                file_digests[i] = file_hash.hexdigest()
+
+        return sha_hash.hexdigest()
+
+    def _tree_hash(self, listed_files, file_digests):
+        """
+        Hash the files missing a digest concurrently, then combine all of the file digests in sorted paths order
+        """
+        missing = [i for i, digest in enumerate(file_digests) if digest is None]
+        missing_paths = [listed_files[i][1] for i in missing]
+
+        if len(missing_paths) > 1 and self.workers > 1:
+            pool = ThreadPool(min(self.workers, len(missing_paths)))
+            try:
+                digests = pool.map(self.hash_file, missing_paths)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            digests = [self.hash_file(file_path) for file_path in missing_paths]
+
+        for i, digest in zip(missing, digests):
+            file_digests[i] = digest
+
+        # Paths are normalized so the hash is the same on all platforms
+        records = sorted((rel_path.replace(os.sep, '/'), digest)
+                         for (rel_path, _), digest in zip(listed_files, file_digests))
+
+        directory_hash = self._new_hash()
+        for rel_path, digest in records:
+            directory_hash.update(rel_path.encode() + b'\0' + digest.encode() + b'\n')
+
+        return directory_hash.hexdigest()
+
+    def hash(self, directory):
+        if not directory.exists():
+            raise ActionOnNonexistingDirectory(directory.path)
+
+        listed_files = directory.files()
+        rel_paths = [rel_path for rel_path, _ in listed_files]
+        stats = [stat_record(file_path) for _, file_path in listed_files]
+
+        index = HashIndex.of_directory(directory, self.algorithm)
+        if index is not None:
+            cached_hash = index.directory_hash(rel_paths, stats)
+            if cached_hash is not None:
+                return cached_hash
+
+        # The digest of a file is only calculated again if the file changed since last indexed
+        file_digests = [index.file_digest(rel_path, file_stat) if index is not None else None
+                        for rel_path, file_stat in zip(rel_paths, stats)]
+
+        if self.algorithm == self.LEGACY_ALGORITHM:
+            directory_hash = self._stream_hash(listed_files, file_digests)
+        else:
+            directory_hash = self._tree_hash(listed_files, file_digests)
+
+        if index is not None:
+            index.update(rel_paths, stats, file_digests, directory_hash)
+
+        return directory_hash
+
+
+class HashIndex(object):
+    """
+    A persistent index of the hashed files of a single directory.
+    Each file is recorded with its size, mtime, inode and content digest,
+    so the directory hash is not calculated again as long as none of its files changed.
+    The legacy algorithm still reads all the files of a changed directory to hash it,
+    the file digests spare reading the unchanged files when comparing and syncing directories.
+    """
+    # The directory of the index files, the index is disabled while it is None
+    index_dir = None
+
+    # Indexes of directories which do not exist anymore are removed at most once in this interval
+    PRUNE_INTERVAL = 24 * 60 * 60  # Seconds
+    PRUNE_MARKER = '.pruned'
+
+    def __init__(self, index_path, directory_path=None):
+        self.index_path = index_path
+        self.directory_path = directory_path
+        self._files = dict()
+        self._hash = None
+        self._indexed_at = 0
+
+        try:
+            with open(self.index_path, 'r') as f:
+                content = json.load(f)
+            self._files = content['files']
+            self._hash = content['hash']
+            self._indexed_at = stat_record(self.index_path)[1]
+        except (EnvironmentError, ValueError, KeyError):
+            # A missing or broken index is the same as an empty one
+            pass
+
+    @classmethod
+    def of_directory(cls, directory, algorithm):
+        # Temporary directories are hashed once, their index would never be used again
+        if cls.index_dir is None or directory.name().startswith(TEMP_DIR_PREFIX):
+            return None
+
+        # The file digests are only relevant for a single algorithm
+        index_name = '{}.{}.json'.format(hashlib.md5(directory.abs().encode()).hexdigest(), algorithm)
+        return cls(os.path.join(cls.index_dir, index_name), directory.abs())
+
+    @classmethod
+    def prune(cls):
+        """
+        Remove the indexes of directories which do not exist anymore, unless they were removed recently
+        """
+        if cls.index_dir is None or not os.path.isdir(cls.index_dir):
+            return
+
+        marker_path = os.path.join(cls.index_dir, cls.PRUNE_MARKER)
+        if os.path.exists(marker_path) and time.time() - os.path.getmtime(marker_path) < cls.PRUNE_INTERVAL:
+            return
+
+        for index_name in os.listdir(cls.index_dir):
+            if not index_name.endswith('.json'):
+                continue
+
+            index_path = os.path.join(cls.index_dir, index_name)
+            try:
+                with open(index_path, 'r') as f:
+                    directory_path = json.load(f).get('path')
+            except (EnvironmentError, ValueError):
+                directory_path = None
+
+            # Indexes written before their directory path was recorded are removed as well
+            if directory_path is None or not os.path.isdir(directory_path):
+                try:
+                    remove_file(index_path)
+                except EnvironmentError:
+                    # Another process might have removed it meanwhile
+                    pass
+
+        with open(marker_path, 'w'):
+            pass
+
+    def _unchanged(self, rel_path, file_stat):
+        if rel_path not in self._files:
+            return False
+
+        # A file modified at the same time the index was written might have changed without affecting its mtime
+        size, mtime_ns, inode = file_stat
+        return self._files[rel_path][:3] == [size, mtime_ns, inode] and mtime_ns < self._indexed_at
+
+    def file_digest(self, rel_path, file_stat):
+        """
+        :return: The indexed content digest of the file, None if it might have changed since indexed
+        """
+        if not self._unchanged(rel_path, file_stat):
+            return None
+        return self._files[rel_path][3]
+
+    def directory_hash(self, rel_paths, stat_records):
+        """
+        :return: The indexed directory hash, None if any of the files might have changed since indexed
+        """
+        if self._hash is None or len(rel_paths) != len(self._files):
+            return None
+        if not all(self._unchanged(rel_path, file_stat) for rel_path, file_stat in zip(rel_paths, stat_records)):
+            return None
+        return self._hash
+
+    def update(self, rel_paths, stat_records, file_digests, directory_hash):
+        self._files = {rel_path: file_stat + [digest]
+                       for rel_path, file_stat, digest in zip(rel_paths, stat_records, file_digests)}
+        self._hash = directory_hash
+
+        if not os.path.exists(os.path.dirname(self.index_path)):
+            os.makedirs(os.path.dirname(self.index_path))
+
+        content = {'path': self.directory_path, 'files': self._files, 'hash': self._hash}
+
+        # Write to a temporary file first, so a concurrent reader never finds a partially written index.
+        # Threads of the same process might index the same directory together
+        temp_path = self.index_path + '.tmp{}.{}'.format(os.getpid(), threading.current_thread().ident)
+        with open(temp_path, 'w') as f:
+            json.dump(content, f)
+        replace_file(temp_path, self.index_path)
+
+        self._indexed_at = stat_record(self.index_path)[1]
+
+
+class HashMemo(object):
+    """
+    Remembers the hashes of directories for the scope of a single run.
+    Whoever writes into a memoized directory is responsible to invalidate it.
+    """
+    def __init__(self):
+        self._hashes = dict()
+
+    def hash(self, directory, algorithm=None, workers=None):
+        """
+        :return: The hash value of the directory, see Directory.hash_value
+        """
+        key = (directory.path, algorithm or DirectoryHasher.LEGACY_ALGORITHM)
+        if key not in self._hashes:
+            self._hashes[key] = directory.hash_value(algorithm, workers)
+        return self._hashes[key]
+
+    def invalidate(self, directory):
+        # The hash of a directory depends on the content of its sub directories, and vice versa
+        for memoized_path, algorithm in list(self._hashes.keys()):
+            if memoized_path == directory.path or \
+                    memoized_path.startswith(directory.path + os.sep) or \
+                    directory.path.startswith(memoized_path + os.sep):
+                self._hashes.pop((memoized_path, algorithm))
+
+
+class FileLock(object):
+    """
+    An advisory lock of a file, shared between processes.
+    Shared locks may be held by multiple processes together, while an exclusive lock is held by a single one
+    """
+    def __init__(self, lock_path, shared=False):
+        self.lock_path = lock_path
+        self.shared = shared
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """
+        :return: True if the lock was acquired, which is always the case for a blocking acquire
+        """
+        assert self._file is None, 'Lock {} is already acquired'.format(self.lock_path)
+
+        try:
+            os.makedirs(os.path.dirname(self.lock_path))
+        except EnvironmentError:
+            # Already exists
+            pass
+
+        self._file = open(self.lock_path, 'a')
+        try:
+            lock_file(self._file, self.shared, blocking)
+        except EnvironmentError:
+            self._file.close()
+            self._file = None
+            if blocking:
+                raise
+            return False
+
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+
+        unlock_file(self._file)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+try:
+    import fcntl
+
+    def lock_file(f, shared, blocking):
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        fcntl.flock(f.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+
+    def unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+except ImportError:
+    import msvcrt
+
+    def lock_file(f, shared, blocking):
+        # Windows has no shared locks, and blocking is done by retrying
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except EnvironmentError:
+                if not blocking:
+                    raise
+                time.sleep(0.1)
+
+    def unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 class JsonFile(dict):
-    def __init__(self, file_path):
+    """
+    A dictionary which is kept updated in a JSON file.
+    Every modification is written immediately, unless made inside a batch, which is written once when it ends:
+
+        with json_file:
+            json_file['a'] = 1
+            json_file['b'] = 2
+
+    If the file is shared between processes, a lock path should be given.
+    The file is then read again under the lock before each write, and only the modified keys are written over it
+    """
+    _REMOVED = object()
+
+    def __init__(self, file_path, compact=False, lock_path=None):
+        """
+        :param compact: Write the file without indentation and whitespaces
+        :param lock_path: The path of a lock file protecting the file from other processes
+        """
         super(JsonFile, self).__init__()
         self.file_path = file_path
+        self._compact = compact
+        self._lock = FileLock(lock_path) if lock_path is not None else None
 
+        self._batch_depth = 0
+        self._modified = False
+        self._changes = dict()
+
+        self._replace_content(self._read())
+
+    def _read(self):
         with open(self.file_path, 'r') as f:
             content = json.load(f)
 
         assert isinstance(content, dict), 'The JSON file should contain a dictionary'
+        return content
 
+    def _replace_content(self, content):
+        super(JsonFile, self).clear()
         for key, val in content.items():
             super(JsonFile, self).__setitem__(key, val)
 
+    def _merged(self, content):
+        """
+        :return: The given content with the modifications which were not written yet
+        """
+        for key, value in self._changes.items():
+            if value is self._REMOVED:
+                content.pop(key, None)
+            else:
+                content[key] = value
+        return content
+
+    def reload(self):
+        """
+        Read the file again, keeping the modifications which were not written yet
+        """
+        if self._lock is None:
+            self._replace_content(self._merged(self._read()))
+            return
+
+        with self._lock:
+            self._replace_content(self._merged(self._read()))
+
     def _update_file(self):
-        with open(self.file_path, 'w') as f:
-            json.dump(self, f, indent=4)
+        if self._batch_depth > 0:
+            self._modified = True
+            return
+
+        self.flush()
+
+    def _write(self):
+        # Write to a temporary file first, so the file is never left partially written
+        temp_path = self.file_path + '.tmp{}.{}'.format(os.getpid(), threading.current_thread().ident)
+        with open(temp_path, 'w') as f:
+            if self._compact:
+                json.dump(self, f, separators=(',', ':'))
+            else:
+                json.dump(self, f, indent=4)
+        replace_file(temp_path, self.file_path)
+
+    def flush(self):
+        if self._lock is None:
+            self._write()
+        else:
+            with self._lock:
+                # Other processes might have modified the file since it was read
+                self._replace_content(self._merged(self._read()))
+                self._write()
+
+        self._changes.clear()
+        self._modified = False
+
+    def __enter__(self):
+        self._batch_depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._batch_depth -= 1
+
+        # Modifications are written even if the batch failed, as they reflect actions which were already done
+        if self._batch_depth == 0 and self._modified:
+            self.flush()
 
     def __setitem__(self, key, value):
         super(JsonFile, self).__setitem__(key, value)
+        self._changes[key] = value
         self._update_file()
 
+    def __delitem__(self, key):
+        super(JsonFile, self).__delitem__(key)
+        self._changes[key] = self._REMOVED
+        self._update_file()
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super(JsonFile, self).pop(key, *default)
+
+        value = super(JsonFile, self).pop(key)
+        self._changes[key] = self._REMOVED
+        self._update_file()
+        return value
+
     def __str__(self):
         return self.file_path
 
 
+def stat_record(file_path):
+    """
+    :return: The size, modification time in nanoseconds and inode of the file, by which its changes are detected
+    """
+    file_stat = os.stat(file_path)
+    mtime_ns = getattr(file_stat, 'st_mtime_ns', int(file_stat.st_mtime * 10**9))
+    return [file_stat.st_size, mtime_ns, file_stat.st_ino]
+
+
+def remove_file(file_path):
+    # Only add the write permission, the file might be hard linked from elsewhere
+    file_mode = os.lstat(file_path).st_mode
+    if not file_mode & stat.S_IWUSR and not stat.S_ISLNK(file_mode):
+        os.chmod(file_path, file_mode | stat.S_IWUSR)
+    os.remove(file_path)
+
+
+def hardlink_file(src, dst):
+    try:
+        os.link(src, dst)
+    except (EnvironmentError, AttributeError):
+        # Hard links are impossible across devices or on some file systems, fall back to a copy
+        shutil.copy2(src, dst)
+
+
+# The FICLONE ioctl request number of linux, cloning a file by sharing its extents (copy-on-write)
+FICLONE = 0x40049409
+
+
+def reflink_file(src, dst):
+    try:
+        import fcntl
+        with open(src, 'rb') as src_file:
+            with open(dst, 'wb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        shutil.copystat(src, dst)
+    except (EnvironmentError, ImportError):
+        # The file system does not support reflinks, fall back to a copy
+        shutil.copy2(src, dst)
+
+
+def replace_file(src, dst):
+    # os.replace does not exist on python 2, where os.rename can not overwrite on windows
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.path.exists(dst) and os.name == 'nt':
+            os.remove(dst)
+        os.rename(src, dst)
+
+
 def xfilter(func, iterable):
     filtered = list(filter(func, iterable))
     if len(filtered) < 1:
@@ -1,6 +1,8 @@
 from combo_core import *
 from .compat import string_types
 from semantic_version import *
+from collections import OrderedDict
+import threading
 
 
 class IncompatibleVersions(ComboException):
@@ -17,28 +19,87 @@ class InvalidVersionNumber(ComboException):
         return 'Invalid version number format for "{}"\n'.format(self._value) + str(self._args)
 
 
-class VersionNumber:
-    default_prefix = ''
+class VersionNumber(object):
+    """
+    A version number, parsed a single time into an integer tuple.
+    Versions are interned, so equal version strings share the same object, while the amount of
+    interned versions is bounded by evicting the least recently used ones.
+    """
+    __slots__ = ('_prefix', '_string', '_parts', '_key', '_caret_key', '_hash')
 
-    def __init__(self, tuple_or_str='1.0', prefix=default_prefix):
+    default_prefix = ''
+    INTERNED_LIMIT = 4096
+    _interned = OrderedDict()
+    _interned_lock = threading.Lock()
+
+    def __new__(cls, tuple_or_str='1.0', prefix=default_prefix):
+        if isinstance(tuple_or_str, string_types):
+            intern_key = (tuple_or_str, prefix)
+        elif is_iterable(tuple_or_str):
+            intern_key = (tuple(tuple_or_str), prefix)
+        else:
+            intern_key = None
+
+        with cls._interned_lock:
+            if intern_key in cls._interned:
+                # Move the version to the end, as the most recently used one
+                version_number = cls._interned.pop(intern_key)
+                cls._interned[intern_key] = version_number
+                return version_number
+
+        version_number = super(VersionNumber, cls).__new__(cls)
+        version_number._parse(tuple_or_str, prefix)
+
+        with cls._interned_lock:
+            cls._interned[intern_key] = version_number
+            while len(cls._interned) > cls.INTERNED_LIMIT:
+                cls._interned.popitem(last=False)
+
+        return version_number
+
+    def _parse(self, tuple_or_str, prefix):
         try:
             if isinstance(tuple_or_str, string_types):
                 self._prefix = prefix
-                self.version = Version(tuple_or_str)
+                version = Version(tuple_or_str)
             elif is_iterable(tuple_or_str):
                 assert all(type(x) is int for x in tuple_or_str), 'Invalid version iterable: {}'.format(tuple_or_str)
                 self._prefix = self.default_prefix
-                self.version = Version('.'.join(tuple_or_str))
+                version = Version('.'.join(map(str, tuple_or_str)))
             else:
                 raise TypeError('Invalid version type "{}" for parameter: {}'.format(type(tuple_or_str), tuple_or_str))
         except BaseException as e:
             raise InvalidVersionNumber(tuple_or_str, prefix, e)
 
+        prerelease = tuple(version.prerelease or ())
+        build = tuple(version.build or ())
+
+        self._string = str(version)
+        self._parts = (version.major, version.minor, version.patch, prerelease, build)
+
+        # A pre-release is lower than its release, numeric identifiers are lower than alphanumeric ones
+        prerelease_key = (0,) + tuple((0, int(x), '') if x.isdigit() else (1, 0, x) for x in prerelease) \
+            if prerelease else (1,)
+        self._key = (version.major, version.minor, version.patch, prerelease_key, build)
+        self._hash = hash(self._key)
+
+        # Versions matching the same caret (^) requirement, the leftmost non zero number and the ones before it
+        if version.major != 0:
+            self._caret_key = (version.major,)
+        elif version.minor != 0:
+            self._caret_key = (0, version.minor)
+        else:
+            self._caret_key = (0, 0, version.patch)
+
+    def __reduce__(self):
+        # Unpickled versions are interned as well
+        return VersionNumber, (self._string, self._prefix)
+
     def as_tuple(self):
-        return tuple(self.version)
+        return self._parts
 
     def as_string(self):
-        return self._prefix + str(self.version)
+        return self._prefix + self._string
 
     @staticmethod
     def validate(tuple_or_str, prefix=default_prefix):
@@ -46,12 +107,16 @@ class VersionNumber:
 
     @staticmethod
     def compatible(*versions):
+        """
+        :return: True if all the versions match the caret requirement of the minimal one.
+                 For example, ^1.2.3 matches 1.x.x, ^0.2.3 matches 0.2.x and ^0.0.3 matches 0.0.3
+        """
         if not all(isinstance(ver, VersionNumber) for ver in versions):
             raise TypeError('Non version types for: {}'.format(
-                filter(lambda ver: not isinstance(ver, VersionNumber), versions)))
+                list(filter(lambda ver: not isinstance(ver, VersionNumber), versions))))
 
-        minimal_version = '^' + str(min(versions))
-        return all(Spec(minimal_version).match(ver) for ver in versions)
+        caret_key = min(versions)._caret_key
+        return all(ver._caret_key == caret_key for ver in versions)
 
     def __str__(self):
         return self.as_string()
@@ -59,12 +124,12 @@ class VersionNumber:
     def __lt__(self, other):
         if not isinstance(other, type(self)):
             raise TypeError('Type of {} should be {}'.format(other, type(self)))
-        return self.version < other.version
+        return self._key < other._key
 
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             raise TypeError('Type of {} should be {}'.format(other, type(self)))
-        return self.version == other.version
+        return self is other or self._key == other._key
 
     def __le__(self, other):
         return self < other or self == other
@@ -73,10 +138,9 @@ class VersionNumber:
         return not self == other
 
     def __hash__(self):
-        return hash(self.version)
+        return self._hash
 
     @staticmethod
     def _remove_prefix(string, prefix):
         assert string.startswith(prefix), 'String {} does not start with prefix {}'.format(string, prefix)
         return string[len(prefix):]
-
@@ -1,6 +1,10 @@
 from __future__ import print_function
 from server_communicator import *
 from combo_tree import *
+from combo_core.resolution_cache import *
+from combo_core.extern_stamp import *
+from multiprocessing.pool import ThreadPool
+import shutil
 
 
 class CorruptedDependency(ComboException):
@@ -12,35 +16,96 @@ class NonExistingCachedPath(NonExistingPath):
 
 
 class DependenciesManager:
+    # The ways of placing a cached dependency in the output directory, by the function used to place each file.
+    # The symlink mode links the whole directory instead
+    EXTERN_MODES = {
+        'copy': shutil.copy2,
+        'hardlink': hardlink_file,
+        'reflink': reflink_file,
+        'symlink': None
+    }
+    DEFAULT_EXTERN_MODE = 'copy'
+
+    # Hashing is limited by the disk rather than the CPUs, so the amount of directories checked together is bounded
+    DEFAULT_CHECK_JOBS = 4
+
     MISMATCH_TYPES = {
         'More contrib': 'More contrib directories than tree dependencies',
         'More tree': 'More tree dependencies than contrib directories',
         'Missing from contrib': 'Dependency from tree missing from contrib',
+        'Dangling link': 'Linked dependency whose cached target was removed',
         'Missing from tree': 'Directory from contrib does not exist in dependencies tree',
         'Modified content': 'Modified content'
     }
 
-    def __init__(self, repo_dir, sources_locator):
+    def __init__(self, repo_dir, sources_locator, jobs=None, pool_type='thread', hash_algorithm=None,
+                 extern_mode=None, cache_size=None, eviction_policy=None, metadata_store=None, git_mirrors=True):
+        """
+        :param repo_dir: The directory of the repository to manage
+        :param sources_locator: An implementation of the SourceLocator interface
+        :param jobs: Amount of concurrent dependency fetches, None for the amount of CPUs.
+                     Also bounds the amount of directories checked concurrently, see DEFAULT_CHECK_JOBS
+        :param pool_type: The fetching pool type, 'thread' or 'process'
+        :param hash_algorithm: The algorithm used to hash newly cached dependencies
+        :param extern_mode: One of EXTERN_MODES, overrides the mode specified by the base manifest
+        :param cache_size: The size limit of the dependencies cache in bytes
+        :param eviction_policy: The name of the cache eviction policy
+        :param metadata_store: The name of the cache metadata store
+        :param git_mirrors: Whether git dependencies are cloned from local mirrors of their remotes
+        """
         self._repo_dir = repo_dir
 
         # Root directory must have base manifest
         self._base_manifest = Manifest(self._repo_dir, ComboRoot())
         assert self._base_manifest.valid_as_root(), '{} is not valid as root manifest'.format(self._base_manifest)
 
+        self._extern_mode = extern_mode or self._base_manifest.extern_mode or self.DEFAULT_EXTERN_MODE
+        if self._extern_mode not in self.EXTERN_MODES:
+            raise KeyError('Unsupported extern mode "{}"'.format(self._extern_mode))
+
+        # Directory hashes are memoized for the lifetime of the manager, which is a single run
+        self._hash_memo = HashMemo()
+
         importer_type = RemoteImporter if isinstance(sources_locator, RemoteSourceLocator) else Importer
-        self._importer = importer_type(sources_locator)
+        self._importer = importer_type(sources_locator, hash_memo=self._hash_memo, hash_algorithm=hash_algorithm,
+                                       cache_size=cache_size, eviction_policy=eviction_policy,
+                                       metadata_store=metadata_store, git_mirrors=git_mirrors)
 
-        self._tree = ComboTree(self._importer)
+        self._tree = ComboTree(self._importer, jobs, pool_type)
+        self._check_jobs = jobs or self.DEFAULT_CHECK_JOBS
         self._tree_initialized = False
 
+        self._sources_locator = sources_locator
+        self._resolutions = ResolutionCache()
+
+        # The externed files are recorded in the output directory, so their modifications are found by their stat
+        self._stamp = ExternStamp(self._base_manifest.output_dir)
+
     def cleanup(self):
         # Clean importer's temporary cached data after finished
         self._importer.cleanup()
 
     def _initialize_tree(self):
         if not self._tree.ready():
-            self._tree.build(self._base_manifest)
-            self._tree.disconnect_outdated_versions()
+            # The dependencies are resolved again only if a manifest or a source changed since they were resolved
+            sources_revision = self._sources_locator.revision()
+            resolution = self._resolutions.load(self._base_manifest, sources_revision)
+
+            if resolution is not None:
+                print('Using the dependencies resolved by a previous run')
+                self._tree.restore(*resolution)
+            else:
+                self._tree.build(self._base_manifest)
+                self._tree.disconnect_outdated_versions()
+                self._resolutions.store(self._base_manifest, sources_revision, self._tree.manifests,
+                                        self._tree.values())
+
+                # Only the manifests were fetched while building, the selected versions are cloned together.
+                # Restored dependencies are not validated here, get_cached_path clones again whatever is missing
+                self._tree.clone_values()
+
+            # The resolved dependencies must stay cached
+            self._importer.pin(self._tree.values())
 
     def is_dirty(self, verbose=False, force=False):
         """
@@ -50,17 +115,29 @@ class DependenciesManager:
         :param force: ignore dependencies corruption
         :return: A boolean indication for the dirty state
         """
-        self._initialize_tree()
-
         if not force:
-            # If a dependency is corrupted, it's not considered dirty since the problem is not due to manifest update
-            if self.is_corrupted():
+            # If a dependency is corrupted, it's not considered dirty since the problem is not due to manifest update.
+            # This is checked before building the tree, which replaces manually edited clones of the cache,
+            # as those might be linked from the output directory
+            try:
+                self.check_corruption()
+            except CorruptedDependency as e:
                 # TODO: A repository can be both dirty an corrupted if the reason is a different dependency.
                 # We still have to check the rest of them for dirtiness
-                print('No informative message yet. repository is corrupted')
+                print('The repository is corrupted: {}'.format(e))
                 return False
 
-        mismatches = self._content_to_tree_mismatches()
+        # Links are left dangling once their targets are evicted from the cache, possibly by another project.
+        # They are found before building the tree, which clones the targets again when the graph is built anew
+        dangling_links = self._dangling_links()
+
+        self._initialize_tree()
+
+        # A dangling link is also missing from contrib, it is reported once
+        dangling_names = [link.name() for link in dangling_links]
+        mismatches = [{'type': self.MISMATCH_TYPES['Dangling link'], 'value': name} for name in dangling_names]
+        mismatches += [mismatch for mismatch in self._content_to_tree_mismatches()
+                       if mismatch['value'] not in dangling_names]
 
         if verbose:
             if mismatches:
@@ -82,18 +159,63 @@ class DependenciesManager:
         as a dependency which was manually replaced to a newer version, a dependency which was manually removed,
         or added with a valid content, would not be detected as corrupted.
         The reason this is "the best we can do", is because we don't have the "last resolved manifest".
+        Directories recorded in the extern stamp as the same dependency are compared by the stamp instead,
+        which hashes only the files whose stat changed.
+        The directories are checked concurrently, the first corrupted one by its path is reported.
         """
-        for contrib_dir in self._output_directories():
+        contrib_dirs = sorted(self._output_directories(), key=str)
+        combo_deps = list()
+        for contrib_dir in contrib_dirs:
             dep_manifest = Manifest(contrib_dir)
-            combo_dep = ComboDep(dep_manifest.name, dep_manifest.version)
-
-            expected_hash = self._importer.get_dep_hash(combo_dep)
-            actual_hash = hash(contrib_dir)
+            combo_deps.append(ComboDep(dep_manifest.name, dep_manifest.version))
+
+        # The cache is only accessed from this thread, a dependency which is not cached is cloned for its hash
+        expected_hashes = dict()
+        for contrib_dir, combo_dep in zip(contrib_dirs, combo_deps):
+            if self._stamp.dependency(contrib_dir) != combo_dep:
+                expected_hashes[combo_dep] = (self._importer.get_dep_hash(combo_dep),
+                                              self._importer.get_dep_hash_algorithm(combo_dep))
+
+        # Directories checked concurrently hash their files serially, so the checking jobs bound the concurrent reads
+        hash_workers = 1 if self._check_jobs > 1 else None
+
+        def corruption(contrib_dir, combo_dep):
+            """
+            :return: The description of the directory's corruption, None if it is not corrupted
+            """
+            if combo_dep not in expected_hashes:
+                modified_files = self._stamp.modified_files(contrib_dir)
+                if modified_files:
+                    return 'Files modified in directory "{}" of "{}": {}'.format(contrib_dir, combo_dep,
+                                                                                ', '.join(modified_files))
+                return None
+
+            expected_hash, algorithm = expected_hashes[combo_dep]
 
             # TODO: Hash should consider git ignore, we need to think about a way to fix this issue
-            if actual_hash != expected_hash:
-                raise CorruptedDependency('Content found in directory "{}" does not match expected content of "{}"'
-                                          .format(contrib_dir, combo_dep))
+            if self._hash_memo.hash(contrib_dir, algorithm, hash_workers) != expected_hash:
+                return 'Content found in directory "{}" does not match expected content of "{}"'.format(contrib_dir,
+                                                                                                     combo_dep)
+            return None
+
+        for description in self._concurrently(corruption, list(zip(contrib_dirs, combo_deps))):
+            if description is not None:
+                raise CorruptedDependency(description)
+
+    def _concurrently(self, func, args_list):
+        """
+        Call the function with each of the given arguments tuples, on a pool of the checking jobs
+        :return: The results, ordered the same as the given arguments
+        """
+        if self._check_jobs == 1 or len(args_list) < 2:
+            return [func(*args) for args in args_list]
+
+        pool = ThreadPool(min(self._check_jobs, len(args_list)))
+        try:
+            return pool.map(lambda args: func(*args), args_list)
+        finally:
+            pool.close()
+            pool.join()
 
     def is_corrupted(self):
         """
@@ -114,12 +236,32 @@ class DependenciesManager:
         # If the repository is not dirty, this means everything is up-to-date and there is nothing to do
         if not self.is_dirty(force=force):
             print('Project is already up-to-date')
+            self._update_stamp()
             return
 
         self._initialize_tree()
         self._extern_from_tree()
+        self._update_stamp()
         return True
 
+    def _update_stamp(self):
+        """
+        Record the dependencies of the output directory which were not recorded as they are now
+        """
+        for dep in self._tree.values():
+            contrib_dir = self.get_dependency_path(dep.name)
+            if self._stamp.dependency(contrib_dir) != dep or self._stamp.modified_files(contrib_dir):
+                self._stamp.record(dep, contrib_dir, self._importer.get_dep_hash_algorithm(dep))
+
+        # Directories of dependencies which are not part of the tree anymore
+        dep_dir_names = set(self.get_dependency_path(dep.name).name() for dep in self._tree.values())
+        for contrib_dir_name in self._stamp.directory_names():
+            if contrib_dir_name not in dep_dir_names:
+                self._stamp.forget(self._base_manifest.output_dir.join(contrib_dir_name))
+
+        if self._base_manifest.output_dir.exists():
+            self._stamp.write()
+
     def get_dependency_path(self, dependency_name):
         return self._base_manifest.output_dir.join(ComboDep.normalize_name_dir(dependency_name))
 
@@ -135,13 +277,19 @@ class DependenciesManager:
     def _extern_dependency(self, dep):
         dst_path = self.get_dependency_path(dep.name)
 
-        if dst_path.exists():
+        if dst_path.exists() or dst_path.is_link():
             raise UnhandledComboException(
                 'Trying to extern dependency {} which already existed at {}'.format(dep, dst_path))
 
         print('Adding dependency {} into {}'.format(dep, dst_path))
         src_path = self._importer.get_cached_path(dep)
-        src_path.copy_to(dst_path)
+
+        copy_function = self.EXTERN_MODES[self._extern_mode]
+        if copy_function is None:
+            src_path.symlink_to(dst_path)
+        else:
+            src_path.copy_to(dst_path, copy_function=copy_function)
+        self._hash_memo.invalidate(dst_path)
 
     @staticmethod
     def _check_for_multiple_versions(dependencies):
@@ -151,6 +299,14 @@ class DependenciesManager:
         if multiple_versions:
             raise LookupError("Multiple versions found: {}".format(multiple_versions))
 
+    def _dangling_links(self):
+        output_dir = self._base_manifest.output_dir
+        if not output_dir.is_dir():
+            return list()
+
+        links = [output_dir.join(name) for name in sorted(os.listdir(output_dir.path))]
+        return [link for link in links if link.is_link() and not link.exists()]
+
     def _output_directories(self):
         return list(filter(Manifest.is_combo_repo, self._base_manifest.output_dir.sons()))
 
@@ -162,11 +318,17 @@ class DependenciesManager:
             try:
                 if self._dep_content_equals(dep):
                     continue
+
+                if self._can_sync(dep):
+                    self._sync_dependency(dep)
+                    continue
+
                 print('Removing deprecated dependency {}'.format(dep.name))
-                self.get_dependency_path(dep.name).delete()
+                self._delete_contrib_dir(self.get_dependency_path(dep.name))
 
             except NonExistingPath:
-                pass
+                # A symbolic link might be left dangling if its cached target was removed
+                self._delete_contrib_dir(self.get_dependency_path(dep.name))
 
             self._extern_dependency(dep)
 
@@ -174,18 +336,71 @@ class DependenciesManager:
         tree_dir_names = [self.get_dependency_path(d.name).name() for d in dependencies]
         for contrib_dir in self._output_directories():
             if contrib_dir.name() not in tree_dir_names:
-                contrib_dir.delete()
+                self._delete_contrib_dir(contrib_dir)
+
+    def _can_sync(self, dep):
+        # A linked directory is replaced by a new link, there are no files to update
+        copy_function = self.EXTERN_MODES[self._extern_mode]
+        return copy_function is not None and not self.get_dependency_path(dep.name).is_link()
+
+    def _sync_dependency(self, dep):
+        """
+        Update the existing directory of the dependency in place, writing only the files which changed
+        """
+        dst_path = self.get_dependency_path(dep.name)
+        src_path = self._importer.get_cached_path(dep)
+
+        print('Updating dependency {} in {}'.format(dep, dst_path))
+        self._stamp.forget(dst_path)
+        added, changed, removed = src_path.sync_to(dst_path, self.EXTERN_MODES[self._extern_mode],
+                                                   self._importer.get_dep_hash_algorithm(dep))
+        self._hash_memo.invalidate(dst_path)
+
+        print('\t{} added, {} changed, {} removed files'.format(len(added), len(changed), len(removed)))
+
+    def _delete_contrib_dir(self, contrib_dir):
+        self._stamp.forget(contrib_dir)
+        contrib_dir.delete()
+        self._hash_memo.invalidate(contrib_dir)
 
     def _dep_content_equals(self, dep):
-        contrib_dir = self.get_dependency_path(dep.name)
-        cached_dir = self._importer.get_cached_path(dep)
+        return self._deps_content_equal([dep])[0]
+
+    def _deps_content_equal(self, deps):
+        """
+        Compare the contrib directories of the given dependencies with their cached content, concurrently
+        :return: A list of the comparison results, ordered the same as the given dependencies
+        """
+        contrib_dirs = [self.get_dependency_path(dep.name) for dep in deps]
+        for contrib_dir in contrib_dirs:
+            if not contrib_dir.exists():
+                raise NonExistingPath('Comparing content of non existing contrib directory {}'.format(contrib_dir))
+
+        # The cached content is not compared if the directory was recorded as the same dependency and not modified
+        def stamped_unmodified(dep, contrib_dir):
+            return self._stamp.dependency(contrib_dir) == dep and self._stamp.modified_files(contrib_dir) == []
+
+        equal = self._concurrently(stamped_unmodified, list(zip(deps, contrib_dirs)))
 
-        if not contrib_dir.exists():
-            raise NonExistingPath('Comparing content of non existing contrib directory {}'.format(contrib_dir))
-        if not cached_dir.exists():
-            raise NonExistingPath('Comparing content of non existing cached directory {}'.format(cached_dir))
+        # The cache is only accessed from this thread, a dependency which is not cached is cloned
+        compared = list()
+        for i, dep in enumerate(deps):
+            if equal[i]:
+                continue
 
-        return contrib_dir == cached_dir
+            cached_dir = self._importer.get_cached_path(dep)
+            if not cached_dir.exists():
+                raise NonExistingPath('Comparing content of non existing cached directory {}'.format(cached_dir))
+            compared.append((i, cached_dir, contrib_dirs[i], self._importer.get_dep_hash_algorithm(dep)))
+
+        # The comparison stops at the first differing file, a modified dependency is not read completely
+        results = self._concurrently(lambda i, cached_dir, contrib_dir, algorithm:
+                                     (i, cached_dir.compare(contrib_dir, algorithm, early_exit=True).empty()),
+                                     compared)
+        for i, result in results:
+            equal[i] = result
+
+        return equal
 
     def _content_to_tree_mismatches(self):
         contrib_dirs = self._output_directories()
@@ -225,9 +440,10 @@ class DependenciesManager:
                 raise UnhandledComboException('Unhandled mismatch between dependency names')
 
         # Content
-        for dep in dependencies:
-            if self.get_dependency_path(dep.name).name() in contrib_dir_names:
-                if not self._dep_content_equals(dep):
-                    mismatches += [{'type': self.MISMATCH_TYPES['Modified content'], 'value': dep.name}]
+        content_deps = sorted((dep for dep in dependencies
+                               if self.get_dependency_path(dep.name).name() in contrib_dir_names), key=str)
+        for dep, content_equals in zip(content_deps, self._deps_content_equal(content_deps)):
+            if not content_equals:
+                mismatches += [{'type': self.MISMATCH_TYPES['Modified content'], 'value': dep.name}]
 
         return mismatches
@@ -2,7 +2,14 @@ from __future__ import print_function
 from combo_core.source_maintainer import *
 from combo_core.importer import *
 from combo_core.compat import connection_error
+from settings import COMBO_SERVER_TIMEOUT, COMBO_SERVER_RETRIES
+from multiprocessing import cpu_count
+from collections import namedtuple, deque
 import requests
+import requests.adapters
+import threading
+import random
+import time
 import json
 
 MAX_RESPONSE_LENGTH = 4096
@@ -16,10 +23,104 @@ class NackFromServer(ComboException):
     pass
 
 
+RequestRecord = namedtuple('RequestRecord', ('method', 'url', 'status', 'latency', 'retries'))
+
+
+class ServerSession(object):
+    """
+    Keeps the connections to the combo server alive between requests,
+    and sums the latencies and retries of the requests. Only the most recent requests are recorded
+    """
+    RETRIED_STATUSES = (500, 502, 503, 504)
+    UNSUPPORTED_STATUSES = (404, 405)
+    BACKOFF_BASE = 0.5  # Seconds
+    BACKOFF_LIMIT = 10  # Seconds
+    RECENT_RECORDS = 100
+
+    def __init__(self, pool_size=None, timeout=None, retries=None):
+        """
+        :param pool_size: Amount of connections kept alive, None for the amount of CPUs like the fetching jobs
+        :param timeout: Connect and read timeouts in seconds, see COMBO_SERVER_TIMEOUT
+        :param retries: Amount of times a failed GET request is retried, see COMBO_SERVER_RETRIES
+        """
+        self.timeout = timeout if timeout is not None else COMBO_SERVER_TIMEOUT
+        self.retries = retries if retries is not None else COMBO_SERVER_RETRIES
+        self.recent_records = deque(maxlen=self.RECENT_RECORDS)
+        self._requests_amount = 0
+        self._retries_amount = 0
+        self._total_latency = 0
+        self._records_lock = threading.Lock()
+
+        pool_size = pool_size or cpu_count()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _backoff(self, attempt):
+        # Randomized, so clients which failed together don't retry together
+        time.sleep(random.uniform(0, min(self.BACKOFF_LIMIT, self.BACKOFF_BASE * 2 ** attempt)))
+
+    def _record(self, method, url, status, start_time, retries):
+        latency = time.time() - start_time
+        with self._records_lock:
+            self.recent_records.append(RequestRecord(method, url, status, latency, retries))
+            self._requests_amount += 1
+            self._retries_amount += retries
+            self._total_latency += latency
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        :param idempotent: Whether the request may be retried, only GET requests are by default,
+                           as other requests might have been handled before failing
+        """
+        idempotent = idempotent if idempotent is not None else method == 'GET'
+        retries = self.retries if idempotent else 0
+        start_time = time.time()
+
+        for attempt in range(retries + 1):
+            try:
+                response = self._session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    self._record(method, url, None, start_time, attempt)
+                    raise
+            else:
+                if response.status_code not in self.RETRIED_STATUSES or attempt == retries:
+                    self._record(method, url, response.status_code, start_time, attempt)
+                    return response
+
+            self._backoff(attempt)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """
+        :return: The amount of requests, the amount of retries and the total latency of all the requests
+        """
+        with self._records_lock:
+            return self._requests_amount, self._retries_amount, self._total_latency
+
+    def close(self):
+        self._session.close()
+
+
 class RemoteSourceLocator(SourceLocator):
-    def __init__(self, address):
+    def __init__(self, address, session=None):
+        """
+        :param address: The address of the combo server
+        :param session: An optional ServerSession shared with other clients of the server
+        """
         self._addr = address
         self._url = 'http://' + ':'.join(str(x) for x in address)
+        self.session = session if session is not None else ServerSession()
+
+        # Cleared once the server turns out not to support the bulk sources request, see UNSUPPORTED_STATUSES
+        self._bulk_supported = True
 
     def _extended_url(self, *args):
         return '/'.join((self._url, ) + args)
@@ -29,7 +130,7 @@ class RemoteSourceLocator(SourceLocator):
         params = {'project_name': project_name, 'project_version': str(version)}
 
         try:
-            response = requests.get(req_url, params=params)
+            response = self.session.get(req_url, params=params)
         except BaseException as e:
             raise ServerConnectionError(
                 'Could not get response for request to "{}" with params "{}"'.format(req_url, params), e)
@@ -41,11 +142,42 @@ class RemoteSourceLocator(SourceLocator):
 
         return source
 
+    def get_sources(self, project_versions):
+        if not self._bulk_supported:
+            return super(RemoteSourceLocator, self).get_sources(project_versions)
+
+        req_url = self._extended_url('get_sources')
+        data = {'project_versions': json.dumps([[project_name, str(version)]
+                                                for project_name, version in project_versions])}
+
+        try:
+            # Locating sources changes nothing on the server, so the request is retried like a GET request
+            response = self.session.post(req_url, data=data, idempotent=True)
+        except EnvironmentError:
+            response = None
+
+        # Servers without the bulk request are asked for every source separately from now on
+        if response is not None and response.status_code in ServerSession.UNSUPPORTED_STATUSES:
+            self._bulk_supported = False
+
+        try:
+            sources = json.loads(response.content.decode()) if response is not None and response.ok else None
+        except ValueError:
+            sources = None
+
+        # Any other failure is not kept, the following requests try the bulk request again
+        if not isinstance(sources, list) or len(sources) != len(project_versions):
+            return super(RemoteSourceLocator, self).get_sources(project_versions)
+
+        # Sources which the server could not locate are asked for separately as well, to raise the same errors
+        return [source if source is not None else self.get_source(project_name, version)
+                for source, (project_name, version) in zip(sources, project_versions)]
+
     def all_sources(self):
         req_url = self._extended_url('get_available_versions')
 
         try:
-            response = requests.get(req_url)
+            response = self.session.get(req_url)
         except BaseException as e:
             raise ServerConnectionError('Could not get response for request to "{}"'.format(req_url), e)
 
@@ -58,8 +190,8 @@ class RemoteSourceLocator(SourceLocator):
 
 
 class RemoteSourceMaintainer(RemoteSourceLocator, SourceMaintainer):
-    def __init__(self, address):
-        super(RemoteSourceMaintainer, self).__init__(address)
+    def __init__(self, address, session=None):
+        super(RemoteSourceMaintainer, self).__init__(address, session)
 
     def add_project(self, project_name, source_type=None):
         req_url = self._extended_url('add_project')
@@ -69,7 +201,7 @@ class RemoteSourceMaintainer(RemoteSourceLocator, SourceMaintainer):
             data['source_type'] = source_type
 
         try:
-            response = requests.post(req_url, data=data)
+            response = self.session.post(req_url, data=data)
             print('Server response: {}'.format(response.content))
         except BaseException as e:
             raise ServerConnectionError('Could not post new project {}'.format(project_name), e)
@@ -81,22 +213,23 @@ class RemoteSourceMaintainer(RemoteSourceLocator, SourceMaintainer):
         data = {'version_details': json.dumps(version_details)}
 
         try:
-            response = requests.post(req_url, data=data)
+            response = self.session.post(req_url, data=data)
             print('Server response: {}'.format(response.content))
         except BaseException as e:
             raise ServerConnectionError('Could not post version located at {}'.format(version_details), e)
 
 
 class RemoteImporter(Importer):
-    def __init__(self, sources_locator):
+    def __init__(self, sources_locator, **kwargs):
         """
         Construct a dependencies importer which uses the combo server
         :param sources_locator: A RemoteSourceLocator object
+        :param kwargs: Passed to the base importer
         """
         if not isinstance(sources_locator, RemoteSourceLocator):
             raise UnhandledComboException(
                 'Invalid sources locator for type for server importer: {}'.format(type(sources_locator)))
-        super(RemoteImporter, self).__init__(sources_locator)
+        super(RemoteImporter, self).__init__(sources_locator, **kwargs)
 
     def get_all_sources_map(self):
         return self._source_locator.all_sources()
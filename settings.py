@@ -1 +1,3 @@
 COMBO_SERVER_ADDRESS = ('localhost', 9999)
+COMBO_SERVER_TIMEOUT = (5, 60)  # Connect and read timeouts, in seconds
+COMBO_SERVER_RETRIES = 3
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The app data directory is taken from the home directory when combo_core is imported
+os.environ['HOME'] = tempfile.mkdtemp(prefix='combo_tests_')
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, 'contrib'))
+sys.path.insert(0, repo_root)
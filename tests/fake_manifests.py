@@ -0,0 +1,108 @@
+"""
+Dependencies graphs made of fake manifests, which are never read from files
+"""
+
+import random
+from collections import Counter
+
+from combo_core.combo_nodes import ComboDep
+
+
+class FakeSource(object):
+    def __init__(self, dep, sons):
+        self.dep = dep
+        self.sons = sons
+
+
+class FakeManifest(object):
+    """
+    Replaces the Manifest of the tree modules, built from the fake source returned by the importer
+    """
+    manifest_file_name = 'combo_manifest.json'
+
+    def __init__(self, source, expected_combo_node=None):
+        self._source = source
+
+    def sons(self):
+        return [{'name': son.name, 'version': str(son.version)} for son in self._source.sons]
+
+    def valid_as_lib(self):
+        return True
+
+    def __eq__(self, other):
+        return self._source.dep == other._source.dep
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class FakeImporter(object):
+    """
+    Supports the importers of both the current tree and the legacy one, counting the fetches of each dependency
+    """
+    def __init__(self, graph):
+        self._graph = graph
+        self.fetched = Counter()
+
+    def _source(self, dep):
+        self.fetched[dep] += 1
+        return FakeSource(dep, self._graph[dep])
+
+    def fetch_files(self, deps, file_name, pool=None):
+        return [self._source(dep) for dep in deps]
+
+    def clone(self, dep):
+        return self._source(dep)
+
+    def get_cached_path(self, dep):
+        return FakeSource(dep, self._graph[dep])
+
+
+def root_manifest(roots):
+    return FakeManifest(FakeSource(None, roots))
+
+
+def random_graph(seed, max_projects=7):
+    """
+    :return: A graph of each dependency and its sons, and the sons of the root.
+             Sons are mostly versions of the following projects, while a few of them form cycles
+    """
+    rnd = random.Random(seed)
+    names = ['Lib {}'.format(i) for i in range(rnd.randint(2, max_projects))]
+    versions = ['1.0.0', '1.1.0', '1.2.0', '2.0.0', '3.0.0']
+
+    deps = [ComboDep(name, version) for name in names for version in rnd.sample(versions, rnd.randint(1, 3))]
+
+    graph = dict()
+    for dep in deps:
+        later = [son for son in deps if names.index(son.name) > names.index(dep.name)]
+        sons = rnd.sample(later, min(len(later), rnd.randint(0, 3)))
+        if rnd.random() < 0.03:
+            sons.append(rnd.choice(deps))
+
+        # A manifest requires a single version of each project
+        graph[dep] = list({son.name: son for son in reversed(sons)}.values())
+
+    roots = list({dep.name: dep for dep in rnd.sample(deps, min(3, len(deps)))}.values())
+    return graph, roots
+
+
+def layered_graph(depth, width):
+    """
+    :return: A graph in which every dependency requires all the dependencies of the next layer, and its roots
+    """
+    layers = [[ComboDep('Lib {}.{}'.format(layer, i), '1.0.0') for i in range(width)] for layer in range(depth)]
+    graph = dict()
+    for layer, deps in enumerate(layers):
+        for dep in deps:
+            graph[dep] = layers[layer + 1] if layer + 1 < depth else list()
+    return graph, layers[0]
+
+
+def binary_graph(nodes_amount):
+    """
+    :return: A graph in which every dependency requires two new ones, until the given amount of dependencies
+    """
+    deps = [ComboDep('Lib {}'.format(i), '1.0.0') for i in range(nodes_amount)]
+    graph = {dep: [deps[son] for son in (2 * i + 1, 2 * i + 2) if son < nodes_amount] for i, dep in enumerate(deps)}
+    return graph, deps[:1]
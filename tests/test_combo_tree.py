@@ -0,0 +1,123 @@
+import pytest
+import time
+
+import combo_tree
+import legacy_combo_tree
+from combo_core import ComboException
+from combo_core.combo_nodes import ComboDep
+from fake_manifests import *
+
+
+@pytest.fixture(autouse=True)
+def fake_manifests(monkeypatch):
+    monkeypatch.setattr(combo_tree, 'Manifest', FakeManifest)
+    monkeypatch.setattr(legacy_combo_tree, 'Manifest', FakeManifest)
+
+
+def built_tree(graph, roots):
+    tree = combo_tree.ComboTree(FakeImporter(graph), jobs=1)
+    tree.build(root_manifest(roots))
+    return tree
+
+
+def error_details(e):
+    return type(e).__name__, e.args
+
+
+def build_outcome(tree_type, graph, roots):
+    tree = tree_type(FakeImporter(graph))
+    try:
+        tree.build(root_manifest(roots))
+    except (ComboException, ValueError) as e:
+        return error_details(e)
+    return str(tree), sorted(map(str, tree.values()))
+
+
+def test_shared_dependency_has_a_single_node():
+    lib_c = ComboDep('Lib C', '1.0.0')
+    lib_a, lib_b = ComboDep('Lib A', '1.0.0'), ComboDep('Lib B', '1.0.0')
+    graph = {lib_a: [lib_c], lib_b: [lib_c], lib_c: []}
+
+    importer = FakeImporter(graph)
+    tree = combo_tree.ComboTree(importer, jobs=1)
+    tree.build(root_manifest([lib_a, lib_b]))
+
+    assert tree.nodes[lib_a].sons[0] is tree.nodes[lib_b].sons[0]
+    assert importer.fetched[lib_c] == 1
+    assert tree.original_nodes is tree.nodes
+
+
+def test_circular_dependency_through_shared_node():
+    lib_a, lib_b, lib_c = ComboDep('Lib A', '1.0.0'), ComboDep('Lib B', '1.0.0'), ComboDep('Lib C', '1.0.0')
+    graph = {lib_a: [lib_c], lib_b: [lib_c], lib_c: [ComboDep('Lib B', '2.0.0')], ComboDep('Lib B', '2.0.0'): []}
+
+    with pytest.raises(combo_tree.CircularDependency):
+        built_tree(graph, [lib_a, lib_b])
+
+
+@pytest.mark.parametrize('seed', range(500))
+def test_build_matches_legacy_tree(seed):
+    graph, roots = random_graph(seed)
+
+    assert build_outcome(lambda importer: combo_tree.ComboTree(importer, jobs=1), graph, roots) == \
+        build_outcome(legacy_combo_tree.ComboTree, graph, roots)
+
+
+def selection_outcome(tree_type, graph, roots):
+    tree = tree_type(FakeImporter(graph))
+    tree.build(root_manifest(roots))
+    try:
+        tree.disconnect_outdated_versions()
+    except ComboException as e:
+        return error_details(e)
+    return str(tree), sorted(map(str, tree.values()))
+
+
+def test_undecidable_versions():
+    lib_a, newer_lib_a = ComboDep('Lib A', '1.0.0'), ComboDep('Lib A', '1.1.0')
+    lib_b, newer_lib_b = ComboDep('Lib B', '1.0.0'), ComboDep('Lib B', '1.1.0')
+    graph = {lib_a: [newer_lib_b], lib_b: [newer_lib_a], newer_lib_a: [], newer_lib_b: []}
+
+    tree = built_tree(graph, [lib_a, lib_b])
+    with pytest.raises(combo_tree.UndecidableVersions):
+        tree.disconnect_outdated_versions()
+
+
+@pytest.mark.parametrize('seed', range(2000))
+def test_selection_matches_legacy_tree(seed):
+    graph, roots = random_graph(seed)
+    try:
+        built_tree(graph, roots)
+    except combo_tree.CircularDependency:
+        pytest.skip('Circular graph, covered by the build tests')
+
+    outcome = selection_outcome(lambda importer: combo_tree.ComboTree(importer, jobs=1), graph, roots)
+    if outcome[0] == 'UndecidableVersions':
+        # The legacy tree never stops slashing such graphs
+        return
+
+    assert outcome == selection_outcome(legacy_combo_tree.ComboTree, graph, roots)
+
+
+def timed_selection(tree_type, graph, roots):
+    start = time.time()
+    tree = tree_type(FakeImporter(graph))
+    tree.build(root_manifest(roots))
+    tree.disconnect_outdated_versions()
+    return time.time() - start
+
+
+@pytest.mark.parametrize('graph, roots', [binary_graph(1000), layered_graph(6, 4)],
+                         ids=['binary', 'layered'])
+def test_large_graph_selection_matches_legacy_tree(graph, roots):
+    assert selection_outcome(lambda importer: combo_tree.ComboTree(importer, jobs=1), graph, roots) == \
+        selection_outcome(legacy_combo_tree.ComboTree, graph, roots)
+
+
+@pytest.mark.parametrize('graph, larger_graph', [(binary_graph(1000), binary_graph(2000)),
+                                                 (layered_graph(6, 4), layered_graph(12, 8))],
+                         ids=['binary', 'layered'])
+def test_larger_graph_is_resolved_faster_than_by_legacy_tree(graph, larger_graph):
+    # The legacy tree walks every path of the graph, the current tree visits every dependency once
+    current = timed_selection(lambda importer: combo_tree.ComboTree(importer, jobs=1), *larger_graph)
+    assert current < timed_selection(legacy_combo_tree.ComboTree, *graph)
@@ -0,0 +1,76 @@
+import json
+import pytest
+
+from dependencies_manager import *
+
+
+def write_manifest(dir_path, content):
+    os.makedirs(str(dir_path))
+    with open(str(dir_path / 'combo_manifest.json'), 'w') as f:
+        json.dump(content, f)
+
+
+@pytest.fixture
+def project(tmp_path):
+    """
+    :return: A root project requiring Lib A, which requires Lib B, and the path of their sources index
+    """
+    sources = dict()
+    for name, dependencies in (('Lib A', [{'name': 'Lib B', 'version': '1.0.0'}]), ('Lib B', [])):
+        lib_dir = tmp_path / 'libs' / name.replace(' ', '_')
+        write_manifest(lib_dir, {'name': name, 'version': '1.0.0', 'dependencies': dependencies})
+        with open(str(lib_dir / 'lib.txt'), 'w') as f:
+            f.write(name)
+        sources[name] = {'1.0.0': {'type': 'file_system', 'path': str(lib_dir)}}
+
+    sources_path = str(tmp_path / 'sources.json')
+    with open(sources_path, 'w') as f:
+        json.dump(sources, f)
+
+    write_manifest(tmp_path / 'root', {'name': 'Root', 'version': '1.0.0', 'output_directory': 'contrib',
+                                       'dependencies': [{'name': 'Lib A', 'version': '1.0.0'}]})
+    return Directory(str(tmp_path / 'root')), sources_path
+
+
+def dependencies_manager(project):
+    repo_dir, sources_path = project
+    return DependenciesManager(repo_dir, IndexerSourceLocator(sources_path), jobs=1)
+
+
+def test_restored_resolution_does_not_validate_the_cache(project, monkeypatch):
+    manager = dependencies_manager(project)
+    manager.resolve()
+    manager.cleanup()
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError('The cached clones are validated for a restored resolution')
+
+    monkeypatch.setattr(Importer, 'clone_all', unexpected)
+    monkeypatch.setattr(CachedData, 'valid', unexpected)
+
+    manager = dependencies_manager(project)
+    assert not manager.is_dirty()
+    manager.cleanup()
+
+
+def test_concurrent_corruption_check_hashes_serially(project, monkeypatch):
+    repo_dir, sources_path = project
+    manager = DependenciesManager(repo_dir, IndexerSourceLocator(sources_path), jobs=4)
+    manager.resolve()
+    manager.cleanup()
+
+    # Without the stamp every directory is hashed
+    os.remove(repo_dir.join('contrib', ExternStamp.FILE_NAME).path)
+    manager = DependenciesManager(repo_dir, IndexerSourceLocator(sources_path), jobs=4)
+
+    hashers_workers = list()
+    original_init = DirectoryHasher.__init__
+
+    def recording_init(self, algorithm=None, workers=None):
+        original_init(self, algorithm, workers)
+        hashers_workers.append(self.workers)
+
+    monkeypatch.setattr(DirectoryHasher, '__init__', recording_init)
+    manager.check_corruption()
+    assert hashers_workers and set(hashers_workers) == {1}
+    manager.cleanup()
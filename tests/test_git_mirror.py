@@ -0,0 +1,106 @@
+import os
+import git
+import pytest
+
+from combo_core.git_api import GitMirror, GitRepo
+from combo_core.source_types import *
+
+
+def commit_files(repo, files):
+    for file_name, content in files.items():
+        with open(os.path.join(repo.working_tree_dir, file_name), 'w') as f:
+            f.write(content)
+    repo.index.add(list(files.keys()))
+    return str(repo.index.commit('Update {}'.format(', '.join(sorted(files)))))
+
+
+@pytest.fixture
+def remote(tmp_path):
+    repo = git.Repo.init(str(tmp_path / 'remote'))
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'Combo')
+        config.set_value('user', 'email', 'combo@example.com')
+    return repo
+
+
+@pytest.fixture(autouse=True)
+def mirrors_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(GitMirror, 'mirrors_dir', str(tmp_path / 'mirrors'))
+
+
+def remote_url(remote):
+    return 'file://' + remote.working_tree_dir
+
+
+def test_export_writes_the_commit_files_only(remote, tmp_path):
+    commit = commit_files(remote, {'combo_manifest.json': '{}\n', 'lib.txt': 'lib\n'})
+
+    dst_path = str(tmp_path / 'export')
+    GitMirror(remote_url(remote)).export(commit, dst_path)
+
+    assert sorted(os.listdir(dst_path)) == ['combo_manifest.json', 'lib.txt']
+    with open(os.path.join(dst_path, 'lib.txt')) as f:
+        assert f.read() == 'lib\n'
+
+
+def test_export_fetches_commits_missing_from_the_mirror(remote, tmp_path):
+    first_commit = commit_files(remote, {'lib.txt': 'first\n'})
+    mirror = GitMirror(remote_url(remote))
+    mirror.export(first_commit, str(tmp_path / 'first'))
+
+    second_commit = commit_files(remote, {'lib.txt': 'second\n'})
+    assert not mirror.has_commit(second_commit)
+
+    GitMirror(remote_url(remote)).export(second_commit, str(tmp_path / 'second'))
+    with open(str(tmp_path / 'second' / 'lib.txt')) as f:
+        assert f.read() == 'second\n'
+    with open(str(tmp_path / 'first' / 'lib.txt')) as f:
+        assert f.read() == 'first\n'
+
+
+def test_export_into_non_empty_directory_fails(remote, tmp_path):
+    commit = commit_files(remote, {'lib.txt': 'lib\n'})
+    dst_dir = tmp_path / 'export'
+    dst_dir.mkdir()
+    (dst_dir / 'existing.txt').write_text(u'existing')
+
+    with pytest.raises(EnvironmentError):
+        GitMirror(remote_url(remote)).export(commit, str(dst_dir))
+
+
+def test_read_file_keeps_the_exact_content(remote):
+    commit = commit_files(remote, {'combo_manifest.json': '{}\n\n'})
+    mirror = GitMirror(remote_url(remote))
+
+    assert mirror.read_file(commit, 'combo_manifest.json') == b'{}\n\n'
+    assert mirror.read_file(commit, 'missing.json') is None
+
+
+def test_fetched_file_is_written_as_is(remote, tmp_path):
+    commit = commit_files(remote, {'combo_manifest.json': '{"name": "Lib A"}\n'})
+    dependency = GitDependency({'src_type': 'git', 'remote_url': remote_url(remote), 'commit_hash': commit})
+
+    file_dir = dependency.fetch_file('combo_manifest.json', Directory(str(tmp_path / 'fetched_files')))
+
+    with open(file_dir.join('combo_manifest.json').path, 'rb') as f:
+        assert f.read() == b'{"name": "Lib A"}\n'
+    assert dependency.fetch_file('combo_manifest.json', Directory(str(tmp_path / 'fetched_files'))) == file_dir
+
+
+def test_clone_falls_back_to_full_clone_when_checkout_fails(remote, tmp_path, monkeypatch):
+    commit = commit_files(remote, {'lib.txt': 'lib\n'})
+    shallow_clone = GitRepo._shallow_clone
+
+    def failing_checkout(self, remote_url, ref):
+        # The files were partially checked out before the failure
+        shallow_clone(self, remote_url, ref)
+        raise git.GitCommandError('checkout', 1)
+
+    monkeypatch.setattr(GitRepo, '_shallow_clone', failing_checkout)
+
+    repo = GitRepo(str(tmp_path / 'clone'))
+    repo.clone(remote_url(remote), commit)
+
+    assert repo.commit_hash() == commit
+    with open(str(tmp_path / 'clone' / 'lib.txt')) as f:
+        assert f.read() == 'lib\n'
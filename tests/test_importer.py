@@ -0,0 +1,70 @@
+import json
+import time
+import pytest
+from multiprocessing.pool import ThreadPool
+
+from combo_core.importer import *
+
+
+@pytest.fixture
+def importer(tmp_path):
+    sources_path = str(tmp_path / 'sources.json')
+    with open(sources_path, 'w') as f:
+        json.dump(dict(), f)
+    return Importer(IndexerSourceLocator(sources_path), clones_dir_name=str(tmp_path / 'clones'))
+
+
+def make_fetched_files(source_digest, age):
+    source_dir = Directory(appdata_dir_path).join('fetched_files', source_digest)
+    os.makedirs(source_dir.path)
+    with open(source_dir.join('combo_manifest.json').path, 'w') as f:
+        f.write('{}')
+
+    modification_time = time.time() - age
+    os.utime(source_dir.path, (modification_time, modification_time))
+    return source_dir
+
+
+def test_cleanup_removes_unused_fetched_files(importer):
+    unused = make_fetched_files('unused', Importer.FETCHED_FILES_MAX_AGE + 60)
+    used = make_fetched_files('used', 60)
+
+    importer.cleanup()
+
+    assert not unused.exists()
+    assert used.join('combo_manifest.json').exists()
+
+
+def test_finished_clones_are_cached_when_another_clone_fails(tmp_path, monkeypatch):
+    sources = dict()
+    for name in ('Lib', 'Broken Lib'):
+        lib_dir = tmp_path / name.replace(' ', '_')
+        os.makedirs(str(lib_dir))
+        with open(str(lib_dir / 'lib.txt'), 'w') as f:
+            f.write(name)
+        sources[name] = {'1.0.0': {'type': 'file_system', 'path': str(lib_dir)}}
+
+    sources_path = str(tmp_path / 'sources.json')
+    with open(sources_path, 'w') as f:
+        json.dump(sources, f)
+    importer = Importer(IndexerSourceLocator(sources_path), clones_dir_name=str(tmp_path / 'clones'))
+
+    clone = FileSystemDependency.clone
+
+    def failing_clone(self, dst_path):
+        if self.dep_src['path'].endswith('Broken_Lib'):
+            raise NonExistingPath('Local path {} does not exist'.format(self.dep_src['path']))
+        clone(self, dst_path)
+
+    monkeypatch.setattr(FileSystemDependency, 'clone', failing_clone)
+
+    lib, broken_lib = ComboDep('Lib', '1.0.0'), ComboDep('Broken Lib', '1.0.0')
+    pool = ThreadPool(2)
+    try:
+        with pytest.raises(NonExistingPath):
+            importer.clone_all([broken_lib, lib], pool)
+    finally:
+        pool.close()
+
+    assert importer._cached_data.has_dep(lib)
+    assert not importer._cached_data.has_dep(broken_lib)
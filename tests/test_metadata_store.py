@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+import pytest
+
+from combo_core.metadata_store import *
+
+
+@pytest.fixture
+def appdata_dir(tmp_path):
+    # Not created in advance, as the app data directory of a first run
+    return Directory(str(tmp_path / 'appdata'))
+
+
+def open_store(appdata_dir):
+    return SqliteMetadataStore(appdata_dir, appdata_dir.join('locks', 'local_projects.lock').path)
+
+
+def test_legacy_int_hash_round_trips(appdata_dir):
+    store = open_store(appdata_dir)
+    store['(Lib A, v1.0.0)'] = {'size': 10, 'hash': 1234567, 'algorithm': 'md5'}
+    store['(Lib B, v1.0.0)'] = {'size': 10, 'hash': '0a1b', 'algorithm': 'blake2b'}
+
+    reopened = open_store(appdata_dir)
+    assert reopened['(Lib A, v1.0.0)']['hash'] == 1234567
+    assert reopened['(Lib B, v1.0.0)']['hash'] == '0a1b'
+
+
+def test_textual_hash_column_is_migrated(appdata_dir):
+    os.makedirs(appdata_dir.path)
+    connection = sqlite3.connect(appdata_dir.join('local_projects.db').path)
+    connection.execute('''
+        CREATE TABLE dependencies (
+            dep TEXT PRIMARY KEY, name TEXT NOT NULL, version TEXT NOT NULL, size INTEGER NOT NULL,
+            hash TEXT NOT NULL, algorithm TEXT, source TEXT, last_access REAL, access_count INTEGER
+        )''')
+    connection.execute("INSERT INTO dependencies (dep, name, version, size, hash) "
+                       "VALUES ('(Lib A, v1.0.0)', 'Lib A', '1.0.0', 10, 1234567)")
+    connection.execute("INSERT INTO dependencies (dep, name, version, size, hash, algorithm) "
+                       "VALUES ('(Lib B, v1.0.0)', 'Lib B', '1.0.0', 10, '0123', 'sha256')")
+    connection.commit()
+    connection.close()
+
+    store = open_store(appdata_dir)
+    assert store['(Lib A, v1.0.0)'] == {'size': 10, 'hash': 1234567}
+    assert store['(Lib B, v1.0.0)']['hash'] == '0123'
+    assert store.with_source(None) == []
+
+
+def test_store_is_shared_between_threads(appdata_dir):
+    store = open_store(appdata_dir)
+    errors = list()
+
+    def add_dependencies(thread_index):
+        try:
+            for i in range(20):
+                dep_str = '(Lib {}, v1.0.{})'.format(thread_index, i)
+                store[dep_str] = {'size': i, 'hash': i, 'source': 'source{}'.format(i)}
+                assert store.pop(dep_str)['size'] == i
+                store[dep_str] = {'size': i, 'hash': i, 'source': 'source{}'.format(i)}
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add_dependencies, args=(thread_index,)) for thread_index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(store.keys()) == 80
+    assert store.used_storage() == sum(range(20))
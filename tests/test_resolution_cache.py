@@ -0,0 +1,57 @@
+import json
+import pytest
+
+from combo_core.resolution_cache import *
+
+
+def make_manifest(dir_path, content, combo_node):
+    os.makedirs(str(dir_path))
+    with open(str(dir_path / Manifest.manifest_file_name), 'w') as f:
+        json.dump(content, f)
+    return Manifest(Directory(str(dir_path)), combo_node)
+
+
+@pytest.fixture
+def resolutions(tmp_path):
+    return ResolutionCache(str(tmp_path / 'resolutions'))
+
+
+@pytest.fixture
+def base_manifest(tmp_path):
+    return make_manifest(tmp_path / 'root', {'name': 'Root', 'version': '1.0.0', 'output_directory': 'contrib',
+                                             'dependencies': [{'name': 'Lib A', 'version': '1.0.0'}]}, ComboRoot())
+
+
+@pytest.fixture
+def manifests(tmp_path):
+    lib_a = ComboDep('Lib A', '1.0.0')
+    return {lib_a: make_manifest(tmp_path / 'Lib_A', {'name': 'Lib A', 'version': '1.0.0', 'dependencies': []},
+                                 lib_a)}
+
+
+def test_resolution_is_restored_with_its_manifests(resolutions, base_manifest, manifests):
+    resolutions.store(base_manifest, 'revision', manifests, list(manifests.keys()))
+
+    dependencies, restored_manifests = resolutions.load(base_manifest, 'revision')
+
+    assert dependencies == list(manifests.keys())
+    assert {dep: manifest.file_path for dep, manifest in restored_manifests.items()} == \
+        {dep: manifest.file_path for dep, manifest in manifests.items()}
+    assert all(restored_manifests[dep].sons() == manifest.sons() for dep, manifest in manifests.items())
+
+
+def test_changed_manifest_resolves_again(resolutions, base_manifest, manifests):
+    resolutions.store(base_manifest, 'revision', manifests, list(manifests.keys()))
+
+    manifest = list(manifests.values())[0]
+    with open(manifest.file_path, 'w') as f:
+        json.dump({'name': 'Lib A', 'version': '1.0.0', 'dependencies': [{'name': 'Lib B', 'version': '1.0.0'}]}, f)
+
+    assert resolutions.load(base_manifest, 'revision') is None
+
+
+def test_other_revision_resolves_again(resolutions, base_manifest, manifests):
+    resolutions.store(base_manifest, 'revision', manifests, list(manifests.keys()))
+
+    assert resolutions.load(base_manifest, 'other revision') is None
+    assert resolutions.load(base_manifest, None) is None
@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+import pytest
+
+from server_communicator import *
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    A local stand-in of the combo server, answering each path with its scripted responses in order.
+    The last response of a path is repeated once the rest were given
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('localhost', 0), StandInHandler)
+        self.responses = dict()
+        self.requests = list()
+        self.clients = set()
+        self.delay = 0
+
+    def respond(self, method, path, *responses):
+        self.responses[(method, path)] = list(responses)
+
+    def next_response(self, method, path):
+        responses = self.responses.get((method, path), [(404, None)])
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, method):
+        content_length = int(self.headers.get('Content-Length') or 0)
+        if content_length:
+            self.rfile.read(content_length)
+
+        path = self.path.split('?')[0]
+        self.server.requests.append((method, path))
+        self.server.clients.add(self.client_address)
+        time.sleep(self.server.delay)
+
+        status, content = self.server.next_response(method, path)
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+@pytest.fixture
+def server():
+    stand_in = StandInServer()
+    thread = threading.Thread(target=stand_in.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield stand_in
+    stand_in.shutdown()
+    stand_in.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(ServerSession, 'BACKOFF_BASE', 0.01)
+
+
+def server_url(server, path):
+    return 'http://localhost:{}{}'.format(server.server_address[1], path)
+
+
+def test_get_is_retried_on_server_errors(server):
+    server.respond('GET', '/get_source', (503, None), (502, None), (200, {'src_type': 'git'}))
+    session = ServerSession(retries=3)
+
+    response = session.get(server_url(server, '/get_source'))
+
+    assert response.status_code == 200
+    assert session.recent_records[-1].retries == 2
+    assert session.stats()[:2] == (1, 2)
+
+
+def test_only_recent_requests_are_recorded(server, monkeypatch):
+    server.respond('GET', '/get_source', (200, {'src_type': 'git'}))
+    monkeypatch.setattr(ServerSession, 'RECENT_RECORDS', 2)
+    session = ServerSession()
+
+    for _ in range(3):
+        session.get(server_url(server, '/get_source'))
+
+    assert len(session.recent_records) == 2
+    assert session.stats()[:2] == (3, 0)
+
+
+def test_get_gives_up_after_the_retries(server):
+    server.respond('GET', '/get_source', (503, None))
+    session = ServerSession(retries=2)
+
+    assert session.get(server_url(server, '/get_source')).status_code == 503
+    assert len(server.requests) == 3
+
+
+def test_post_is_not_retried(server):
+    server.respond('POST', '/add_version', (503, None), (200, 'added'))
+    session = ServerSession(retries=3)
+
+    assert session.post(server_url(server, '/add_version'), data={'version_details': '{}'}).status_code == 503
+    assert len(server.requests) == 1
+
+
+def test_timeout_is_retried_then_raised(server):
+    server.respond('GET', '/get_source', (200, None))
+    server.delay = 0.5
+    session = ServerSession(timeout=(1, 0.1), retries=1)
+
+    with pytest.raises(requests.Timeout):
+        session.get(server_url(server, '/get_source'))
+    assert session.recent_records[-1].status is None
+    assert session.recent_records[-1].retries == 1
+
+
+def test_connections_are_kept_alive(server):
+    server.respond('GET', '/get_source', (200, {'src_type': 'git'}))
+    locator = RemoteSourceLocator(('localhost', server.server_address[1]), ServerSession(pool_size=1))
+
+    for _ in range(5):
+        locator.get_source('Lib A', '1.0.0')
+
+    assert len(server.clients) == 1
+
+
+def source(project_name):
+    return {'src_type': 'file_system', 'path': project_name}
+
+
+def remote_locator(server):
+    return RemoteSourceLocator(('localhost', server.server_address[1]), ServerSession(retries=2))
+
+
+PROJECT_VERSIONS = [('Lib A', '1.0.0'), ('Lib B', '1.0.0')]
+
+
+def test_sources_are_located_in_bulk(server):
+    server.respond('POST', '/get_sources', (200, [source('Lib A'), source('Lib B')]))
+
+    assert remote_locator(server).get_sources(PROJECT_VERSIONS) == [source('Lib A'), source('Lib B')]
+    assert server.requests == [('POST', '/get_sources')]
+
+
+def test_bulk_request_is_disabled_when_unsupported(server):
+    server.respond('POST', '/get_sources', (404, None))
+    server.respond('GET', '/get_source', (200, source('Lib')))
+    locator = remote_locator(server)
+
+    assert locator.get_sources(PROJECT_VERSIONS) == [source('Lib'), source('Lib')]
+    assert locator.get_sources(PROJECT_VERSIONS) == [source('Lib'), source('Lib')]
+    assert server.requests == [('POST', '/get_sources')] + [('GET', '/get_source')] * 4
+
+
+def test_bulk_request_is_retried_on_transient_errors(server):
+    server.respond('POST', '/get_sources', (503, None), (200, [source('Lib A'), source('Lib B')]))
+
+    assert remote_locator(server).get_sources(PROJECT_VERSIONS) == [source('Lib A'), source('Lib B')]
+    assert server.requests == [('POST', '/get_sources')] * 2
+
+
+def test_bulk_request_is_kept_after_failing(server):
+    server.respond('POST', '/get_sources', (500, None), (500, None), (500, None),
+                   (200, [source('Lib A'), source('Lib B')]))
+    server.respond('GET', '/get_source', (200, source('Lib')))
+    locator = remote_locator(server)
+
+    assert locator.get_sources(PROJECT_VERSIONS) == [source('Lib'), source('Lib')]
+    assert locator.get_sources(PROJECT_VERSIONS) == [source('Lib A'), source('Lib B')]
+    assert server.requests == [('POST', '/get_sources')] * 3 + [('GET', '/get_source')] * 2 + \
+        [('POST', '/get_sources')]
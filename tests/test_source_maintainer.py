@@ -0,0 +1,49 @@
+import json
+import os
+import pytest
+
+from combo_core.source_maintainer import *
+
+
+def make_version(base_dir, name, version):
+    version_dir = base_dir / '{}_{}'.format(name.replace(' ', '_'), version)
+    version_dir.mkdir()
+    with open(str(version_dir / 'combo_manifest.json'), 'w') as f:
+        json.dump({'name': name, 'version': version, 'dependencies': []}, f)
+    return {'type': 'file_system', 'path': str(version_dir)}
+
+
+@pytest.fixture
+def maintainer(tmp_path):
+    index_path = str(tmp_path / 'sources.json')
+    with open(index_path, 'w') as f:
+        json.dump({'Lib A': {}}, f)
+    return IndexerSourceMaintainer(index_path, clones_dir_name=str(tmp_path / 'clones'))
+
+
+def test_add_versions_writes_the_index_once(maintainer, tmp_path, monkeypatch):
+    versions_details = [make_version(tmp_path, 'Lib A', '1.0.0'), make_version(tmp_path, 'Lib A', '1.1.0')]
+
+    writes = list()
+    original_write = JsonFile._write
+    monkeypatch.setattr(JsonFile, '_write', lambda json_file: writes.append(json_file.file_path) or
+                        original_write(json_file))
+
+    added = maintainer.add_versions(versions_details)
+
+    assert [str(dep) for dep in added] == ['(Lib A, v1.0.0)', '(Lib A, v1.1.0)']
+    assert writes == [maintainer.get_json_file_path()]
+    with open(maintainer.get_json_file_path()) as f:
+        assert sorted(json.load(f)['Lib A'].keys()) == ['1.0.0', '1.1.0']
+
+
+def test_add_versions_keeps_the_versions_added_before_a_failure(maintainer, tmp_path):
+    versions_details = [make_version(tmp_path, 'Lib A', '1.0.0'), make_version(tmp_path, 'Lib A', '1.0.0_copy')]
+    with open(os.path.join(versions_details[1]['path'], 'combo_manifest.json'), 'w') as f:
+        json.dump({'name': 'Lib A', 'version': '1.0.0', 'dependencies': []}, f)
+
+    with pytest.raises(VersionAlreadyExists):
+        maintainer.add_versions(versions_details)
+
+    with open(maintainer.get_json_file_path()) as f:
+        assert list(json.load(f)['Lib A'].keys()) == ['1.0.0']